@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Time the PSTree and treebanks operations that visit every node on deep,
+right-branching trees, comparing them with recursive versions (as they were
+before they used explicit stacks) where those are within the recursion limit.
+
+  ./benchmarks/deep_trees.py [--depth N] [--trees N]
+
+--depth is the number of words in each tree (default 5000), and the tree is
+about twice that deep.  --trees is the number of trees (default 10).'''
+
+import os
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from berkeley_parse_analyser.nlp_util import pstree, treebanks, init
+
+def right_branching(words):
+    '''(ROOT (S (NN w0) (S (NN w1) (S ... (NN wn)))) with function tags, A-over-A
+    unaries and traces along the way.'''
+    text = ''
+    for i in range(words - 1):
+        if i % 10 == 0:
+            text += '(S-TPC (S (-NONE- *T*) (NN w{}) '.format(i)
+        else:
+            text += '(S (NN w{}) '.format(i)
+    text += '(NN w{})'.format(words - 1)
+    closing = words - 1 + (words - 2) // 10 + 1
+    return '(ROOT ' + text + ')' * closing + ')'
+
+
+def recursive_clone(tree):
+    ans = pstree.PSTree(tree.word, tree.label, tree.span)
+    for subtree in tree.subtrees:
+        subclone = recursive_clone(subtree)
+        subclone.parent = ans
+        ans.subtrees.append(subclone)
+    return ans
+
+
+def recursive_repr(tree):
+    ans = '('
+    if tree.is_trace():
+        ans += pstree.TRACE_LABEL + ' ' + tree.word
+    elif tree.is_terminal():
+        ans += tree.label + ' ' + tree.word
+    else:
+        ans += tree.label
+    for subtree in tree.subtrees:
+        ans += ' ' + recursive_repr(subtree)
+    ans += ')'
+    return ans
+
+
+def recursive_node_dict(tree, depth=0, node_dict=None):
+    if node_dict is None:
+        node_dict = defaultdict(lambda: [])
+    for subtree in tree.subtrees:
+        recursive_node_dict(subtree, depth + 1, node_dict)
+    node_dict[(tree.label, tree.span[0], tree.span[1])].append(depth)
+    return node_dict
+
+
+def recursive_production_list(tree, ans=None):
+    if ans is None:
+        ans = []
+    if len(tree.subtrees) > 0:
+        ans.append((tree.label, tree.span, tuple([(sub.label, sub.span[1]) for sub in tree.subtrees])))
+        for sub in tree.subtrees:
+            recursive_production_list(sub, ans)
+    return ans
+
+
+OPERATIONS = [
+    ('clone', lambda tree: tree.clone(), recursive_clone),
+    ('repr', repr, recursive_repr),
+    ('node_dict', lambda tree: tree.node_dict(), recursive_node_dict),
+    ('production_list', lambda tree: tree.production_list(), recursive_production_list),
+    ('word_yield', lambda tree: tree.word_yield(), None),
+    ('get_nodes', lambda tree: tree.get_nodes('all', 0, 1), None),
+    ('calculate_spans', lambda tree: tree.calculate_spans(), None),
+    ('check_consistency', lambda tree: tree.check_consistency(), None),
+    ('root', lambda tree: tree.get_nodes('lowest', 0, 1).root(), None),
+    ('remove_traces', lambda tree: treebanks.remove_traces(tree, False), None),
+    ('remove_function_tags', lambda tree: treebanks.remove_function_tags(tree, False), None),
+    ('remove_trivial_unaries', lambda tree: treebanks.remove_trivial_unaries(tree, False), None),
+]
+
+def time_operation(operation, trees):
+    start = time.time()
+    for tree in trees:
+        try:
+            operation(tree)
+        except RecursionError:
+            return None
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    args, options = init.get_options(sys.argv, {'depth': 5000, 'trees': 10})
+    init.argcheck(args, 1, 1, 'Time tree operations on deep trees', '[--depth N] [--trees N]')
+
+    text = right_branching(options['depth'])
+    trees = [pstree.tree_from_text(text) for _ in range(options['trees'])]
+    print("{} trees, {} words, recursion limit {}".format(len(trees), options['depth'], sys.getrecursionlimit()))
+    print("{:<24} {:>12} {:>12}".format('operation', 'iterative s', 'recursive s'))
+    for name, iterative, recursive in OPERATIONS:
+        row = [time_operation(iterative, trees)]
+        if recursive is not None:
+            row.append(time_operation(recursive, trees))
+        row = ['-' if value is None else '{:.3f}'.format(value) for value in row]
+        if recursive is None:
+            row.append('')
+        elif row[1] == '-':
+            row[1] = 'too deep'
+        print("{:<24} {:>12} {:>12}".format(name, *row))
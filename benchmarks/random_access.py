@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Time getting single trees from a large treebank, comparing reading through
+the file with generate_trees up to the tree wanted with the offset index in
+nlp_util.tree_index (building it, opening it again once it is saved, and
+getting each tree).
+
+  ./benchmarks/random_access.py [--copies N] [--gets N] <treebank> [<treebank> ...]
+
+The trees are written to a temporary file N times over, one per line.  --gets
+is the number of randomly chosen trees to get (default 100), and reading
+through the file is timed for the first ten of them.'''
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from berkeley_parse_analyser.nlp_util import treebanks, tree_index, init
+
+def scan_to(filename, number):
+    for sent_no, tree in enumerate(treebanks.generate_trees(filename), 1):
+        if sent_no == number:
+            return tree
+
+
+if __name__ == '__main__':
+    args, options = init.get_options(sys.argv, {'copies': 10, 'gets': 100})
+    init.argcheck(args, 2, -1, 'Time random access to trees', '[--copies N] [--gets N] <treebank> [<treebank> ...]')
+
+    texts = []
+    for filename in args[1:]:
+        texts += [str(tree) for tree in treebanks.generate_trees(filename, allow_empty_labels=True)]
+    with tempfile.NamedTemporaryFile('w', suffix='.mrg', delete=False) as out:
+        for _ in range(options['copies']):
+            for text in texts:
+                print(text, file=out)
+        filename = out.name
+    total = len(texts) * options['copies']
+    numbers = [random.randint(1, total) for _ in range(options['gets'])]
+    print("{} trees, {:.2f} MB".format(total, os.path.getsize(filename) / 1e6))
+
+    try:
+        for file_format in ['lines', 'ptb']:
+            start = time.time()
+            tree_index.TreeIndex(filename, file_format).close()
+            built = time.time() - start
+            start = time.time()
+            index = tree_index.TreeIndex(filename, file_format)
+            opened = time.time() - start
+            start = time.time()
+            for number in numbers:
+                if repr(index.tree(number)) != texts[(number - 1) % len(texts)]:
+                    print("Tree {} differs".format(number))
+            per_get = (time.time() - start) / len(numbers)
+            index.close()
+            os.remove(tree_index.index_filename(filename, file_format))
+            print("{:<6} index built in {:.3f}s, opened in {:.4f}s, {:.6f}s per tree".format(file_format, built, opened, per_get))
+
+        start = time.time()
+        for number in numbers[:10]:
+            scan_to(filename, number)
+        print("generate_trees to each tree, {:.3f}s per tree".format((time.time() - start) / len(numbers[:10])))
+    finally:
+        os.remove(filename)
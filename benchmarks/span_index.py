@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Measure the time to find nodes by span and label, scanning the tree (as
+tree_transform does without an index) and using a SpanIndex, and the cost of
+building the index and keeping it up to date as the tree is changed.
+
+  ./benchmarks/span_index.py [--repeats N] <treebank> [<treebank> ...]
+
+--repeats runs each lookup and edit N times.'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from berkeley_parse_analyser.nlp_util import pstree, treebanks, init, tree_transform
+
+def scan_find(tree, span, label):
+    nodes = tree.get_nodes('all', span[0], span[1])
+    return [node for node in nodes if node.label == label]
+
+
+def time_lookups(trees, brackets, find, repeats):
+    start = time.time()
+    for _ in range(repeats):
+        for tree, bracket_list in zip(trees, brackets):
+            for span, label in bracket_list:
+                find(tree, span, label)
+    return time.time() - start
+
+
+def time_edits(trees, brackets, indexes, repeats):
+    '''Relabel each bracket and put it back, recording edits, then undo.'''
+    start = time.time()
+    for _ in range(repeats):
+        for tree, bracket_list, index in zip(trees, brackets, indexes):
+            edits = []
+            for span, label in bracket_list:
+                tree_transform.change_label(tree, 'X', span, label, edits=edits, index=index)
+                tree_transform.change_label(tree, label, span, 'X', edits=edits, index=index)
+            tree_transform.undo(edits, index)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    args, options = init.get_options(sys.argv, {'repeats': 1})
+    init.argcheck(args, 2, -1, 'Time span lookups with and without an index', '[--repeats N] <treebank> [<treebank> ...]')
+    repeats = options['repeats']
+
+    trees = []
+    for filename in args[1:]:
+        trees += list(treebanks.generate_trees(filename, allow_empty_labels=True))
+    brackets = [[(node.span, node.label) for node in tree if not node.is_terminal()] for tree in trees]
+    count = sum(len(bracket_list) for bracket_list in brackets)
+
+    start = time.time()
+    indexes = [pstree.SpanIndex(tree) for tree in trees]
+    build = time.time() - start
+
+    print("{} trees, {} brackets, {} repeats".format(len(trees), count, repeats))
+    print("{:<14} {:>10}".format('index build s', '{:.3f}'.format(build)))
+    print("{:<14} {:>10} {:>10}".format('', 'scan s', 'index s'))
+    scan = time_lookups(trees, brackets, scan_find, repeats)
+    indexed = time_lookups(indexes, brackets, lambda index, span, label: index.find(span, label), repeats)
+    print("{:<14} {:>10.3f} {:>10.3f}".format('find', scan, indexed))
+    scan = time_edits(trees, brackets, [None] * len(trees), repeats)
+    indexed = time_edits(trees, brackets, indexes, repeats)
+    print("{:<14} {:>10.3f} {:>10.3f}".format('relabel', scan, indexed))
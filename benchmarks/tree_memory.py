@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Measure the memory used by trees held in memory, and the time to clone
+them, comparing PSTree with an equivalent node class that keeps its attributes
+in a __dict__ (as PSTree did before it used __slots__), and with FlatTree.
+
+  ./benchmarks/tree_memory.py [--copies N] <treebank> [<treebank> ...]
+
+--copies reads the treebanks N times, to simulate a larger corpus.'''
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from berkeley_parse_analyser.nlp_util import pstree, treebanks, init, flat_tree
+
+class DictNode:
+    '''A tree node with the fields of PSTree, stored in a __dict__.'''
+    def __init__(self, word, label, span, parent=None):
+        self.word = word
+        self.label = label
+        self.span = span
+        self.parent = parent
+        self.subtrees = []
+
+    def clone(self):
+        ans = DictNode(self.word, self.label, self.span)
+        for subtree in self.subtrees:
+            subclone = subtree.clone()
+            subclone.parent = ans
+            ans.subtrees.append(subclone)
+        return ans
+
+
+def to_dict_nodes(tree, parent=None):
+    ans = DictNode(tree.word, tree.label, tree.span, parent)
+    for subtree in tree.subtrees:
+        ans.subtrees.append(to_dict_nodes(subtree, ans))
+    return ans
+
+
+def measure(build):
+    '''Memory retained by the result of build, and the result.'''
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, result
+
+
+def time_clones(trees):
+    start = time.time()
+    for tree in trees:
+        tree.clone()
+    return time.time() - start
+
+
+def time_access(trees):
+    '''Time a traversal that reads every field of every node.'''
+    start = time.time()
+    total = 0
+    for tree in trees:
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            total += node.span[1] - node.span[0] + len(node.label)
+            if node.word is not None and node.parent is not None:
+                total += 1
+            stack.extend(node.subtrees)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    args, options = init.get_options(sys.argv, {'copies': 1})
+    init.argcheck(args, 2, -1, 'Measure memory used by trees', '[--copies N] <treebank> [<treebank> ...]')
+
+    texts = []
+    for filename in args[1:]:
+        texts += [str(tree) for tree in treebanks.generate_trees(filename, allow_empty_labels=True)]
+    texts *= options['copies']
+
+    # Each is built from the text, so neither shares strings with the other
+    slot_bytes, trees = measure(lambda: [pstree.tree_from_text(text, allow_empty_labels=True) for text in texts])
+    dict_bytes, dict_trees = measure(lambda: [to_dict_nodes(pstree.tree_from_text(text, allow_empty_labels=True)) for text in texts])
+    flat_bytes, flat_trees = measure(lambda: [flat_tree.FlatTree.from_pstree(pstree.tree_from_text(text, allow_empty_labels=True)) for text in texts])
+    flat_trees = [tree.root() for tree in flat_trees]
+    nodes = sum(len(list(tree)) for tree in trees)
+
+    print("{} trees, {} nodes".format(len(trees), nodes))
+    print("{:<10} {:>12} {:>10} {:>10} {:>10}".format('nodes', 'bytes', 'per node', 'clone s', 'access s'))
+    for name, size, group in [('__dict__', dict_bytes, dict_trees), ('__slots__', slot_bytes, trees), ('FlatTree', flat_bytes, flat_trees)]:
+        print("{:<10} {:>12} {:>10.1f} {:>10.3f} {:>10.3f}".format(name, size, size / nodes,
+            time_clones(group), time_access(group)))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Measure the throughput of pstree.tree_from_text, in MB of bracketed text
+per second, comparing it with the parser it replaced, which read the text a
+character at a time, and with general_tree_from_text, which it uses for text
+that is not simple.
+
+  ./benchmarks/tree_parsing.py [--copies N] <treebank> [<treebank> ...]
+
+Treebanks should have one tree per line.  --copies parses the text N times.'''
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from berkeley_parse_analyser.nlp_util import pstree, labels, init
+
+def char_tree_from_text(text, allow_empty_labels=False, allow_empty_words=False):
+    '''The character at a time parser.'''
+    root = None
+    cur = None
+    pos = 0
+    word = ''
+    for char in text:
+        if cur is None:
+            if char == '(':
+                root = pstree.PSTree()
+                cur = root
+            continue
+
+        if char == '(':
+            word = word.strip()
+            if cur.label is pstree.DEFAULT_LABEL:
+                if len(word) == 0 and not allow_empty_labels:
+                    raise Exception("Empty label found\n%s" % text)
+                cur.label = labels.intern(word)
+                word = ''
+            if word != '':
+                raise Exception("Stray '%s' while processing\n%s" % (word, text))
+            sub = pstree.PSTree()
+            cur.subtrees.append(sub)
+            sub.parent = cur
+            cur = sub
+        elif char == ')':
+            word = word.strip()
+            if word != '':
+                cur.word = word
+                word = ''
+                cur.span = (pos, pos + 1)
+                pos += 1
+            else:
+                cur.span = (cur.subtrees[0].span[0], cur.subtrees[-1].span[1])
+            cur = cur.parent
+        elif char == ' ':
+            if cur.label is pstree.DEFAULT_LABEL:
+                if len(word) == 0 and not allow_empty_labels:
+                    raise Exception("Empty label found\n%s" % text)
+                cur.label = labels.intern(word)
+                word = ''
+            else:
+                word += char
+        else:
+            word += char
+    if cur is not None:
+        raise Exception("Text did not include complete tree\n%s" % text)
+    return root
+
+
+def throughput(parse, texts, size):
+    start = time.time()
+    for text in texts:
+        parse(text)
+    seconds = time.time() - start
+    return seconds, size / seconds / 1e6
+
+
+if __name__ == '__main__':
+    args, options = init.get_options(sys.argv, {'copies': 1})
+    init.argcheck(args, 2, -1, 'Measure tree parsing throughput', '[--copies N] <treebank> [<treebank> ...]')
+
+    texts = []
+    for filename in args[1:]:
+        with open(filename) as src:
+            texts += [line for line in src if '(' in line]
+    texts *= options['copies']
+    size = sum(len(text.encode('utf-8')) for text in texts)
+
+    for text in texts:
+        if repr(pstree.tree_from_text(text)) != repr(char_tree_from_text(text)):
+            print("Trees differ for:", text)
+
+    print("{} trees, {:.2f} MB".format(len(texts), size / 1e6))
+    print("{:<16} {:>10} {:>10}".format('parser', 'seconds', 'MB/s'))
+    parsers = [
+        ('by character', char_tree_from_text),
+        ('general', pstree.general_tree_from_text),
+        ('tree_from_text', pstree.tree_from_text),
+    ]
+    for name, parse in parsers:
+        print("{:<16} {:>10.3f} {:>10.2f}".format(name, *throughput(parse, texts, size)))
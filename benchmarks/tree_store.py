@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Compare loading normalised trees from a binary file written by
+nlp_util.tree_store with reading bracketed text and normalising it (with the
+edits used for analysis, homogenise_tree and apply_collins_rules), giving the
+size of each file and the time to get every tree as a FlatTree and as a
+PSTree.
+
+  ./benchmarks/tree_store.py [--copies N] <treebank> [<treebank> ...]
+
+The trees are written to a temporary file N times over, one per line.  Only
+the words and labels in the trees go into the binary file's tables, so with
+many copies the tables are a smaller part of the file than they would be for
+the same number of distinct trees.'''
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from berkeley_parse_analyser.nlp_util import treebanks, tree_store, init
+
+def normalised_trees(filename):
+    for tree in treebanks.generate_trees(filename, return_empty=True, allow_empty_labels=True):
+        if tree is not None:
+            tree = treebanks.homogenise_tree(tree)
+            treebanks.apply_collins_rules(tree)
+        yield tree
+
+
+def load_flat(filename):
+    store = tree_store.TreeStore(filename)
+    trees = [store.flat(number) for number in range(1, len(store) + 1)]
+    store.close()
+    return trees
+
+
+if __name__ == '__main__':
+    args, options = init.get_options(sys.argv, {'copies': 100})
+    init.argcheck(args, 2, -1, 'Compare loading stored trees with reading text', '[--copies N] <treebank> [<treebank> ...]')
+
+    texts = []
+    for filename in args[1:]:
+        texts += [str(tree) for tree in treebanks.generate_trees(filename, allow_empty_labels=True)]
+    with tempfile.NamedTemporaryFile('w', suffix='.mrg', delete=False) as out:
+        for _ in range(options['copies']):
+            for text in texts:
+                print(text, file=out)
+        text_name = out.name
+    store_name = text_name + '.trees'
+
+    try:
+        start = time.time()
+        expected = list(normalised_trees(text_name))
+        reading = time.time() - start
+        start = time.time()
+        tree_store.write_trees(store_name, expected)
+        writing = time.time() - start
+        start = time.time()
+        flats = load_flat(store_name)
+        loading = time.time() - start
+        start = time.time()
+        trees = list(tree_store.read_trees(store_name))
+        thawing = time.time() - start
+        if [repr(tree) for tree in trees] != [repr(tree) for tree in expected]:
+            print("Stored trees differ")
+
+        print("{} trees".format(len(expected)))
+        print("text {:.2f} MB, stored {:.2f} MB".format(os.path.getsize(text_name) / 1e6, os.path.getsize(store_name) / 1e6))
+        print("{:<36} {:>10}".format('', 'seconds'))
+        print("{:<36} {:>10.3f}".format('read and normalise text', reading))
+        print("{:<36} {:>10.3f}".format('write stored trees', writing))
+        print("{:<36} {:>10.3f}".format('load stored trees as FlatTrees', loading))
+        print("{:<36} {:>10.3f}".format('load stored trees as PSTrees', thawing))
+    finally:
+        os.remove(text_name)
+        if os.path.exists(store_name):
+            os.remove(store_name)
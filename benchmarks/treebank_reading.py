@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+'''Measure the throughput of reading treebank files, in MB per second,
+comparing calling ptb_read_tree for each tree (which reads a character at a
+time) with generate_trees (which reads the file in blocks).  Times are given
+for splitting the file into trees only (including the way ptb_read_tree used
+to do it), and for building the trees as well.
+
+  ./benchmarks/treebank_reading.py [--copies N] [--one_per_line] <treebank> [<treebank> ...]
+
+The trees are written to a temporary file N times over, indented across
+several lines like the Penn Treebank, or one per line with --one_per_line.'''
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from berkeley_parse_analyser.nlp_util import treebanks, init
+
+def indented(tree, depth=0):
+    '''The tree across several lines, with a line for each phrase.'''
+    if tree.is_terminal():
+        return "({} {})".format(tree.label, tree.word)
+    parts = []
+    for subtree in tree.subtrees:
+        if subtree.is_terminal():
+            parts.append(' ' + indented(subtree, depth + 1))
+        else:
+            parts.append('\n' + '  ' * (depth + 1) + indented(subtree, depth + 1))
+    return "(" + tree.label + ''.join(parts) + " )"
+
+
+def read_by_character(filename):
+    with open(filename) as src:
+        while treebanks.ptb_read_tree(src) is not None:
+            pass
+
+
+def read_in_blocks(filename):
+    for tree in treebanks.generate_trees(filename):
+        pass
+
+
+def split_by_character(filename):
+    '''The scanning ptb_read_tree did before it tracked brackets as it read,
+    without building trees.'''
+    with open(filename) as src:
+        while True:
+            cur_text = ''
+            depth = 0
+            while True:
+                char = src.read(1)
+                if char == '':
+                    return
+                if char in '\n\t':
+                    char = ' '
+                cur_text += char
+                if char == '(':
+                    depth += 1
+                elif char == ')':
+                    depth -= 1
+                if depth == 0:
+                    if '()' in cur_text:
+                        cur_text = ''
+                        continue
+                    if '(' in cur_text:
+                        break
+
+
+def split_in_blocks(filename):
+    with open(filename) as src:
+        for text in treebanks.ptb_tree_texts(src):
+            pass
+
+
+if __name__ == '__main__':
+    args, options = init.get_options(sys.argv, {'copies': 1, 'one_per_line': False})
+    init.argcheck(args, 2, -1, 'Measure treebank reading throughput', '[--copies N] [--one_per_line] <treebank> [<treebank> ...]')
+
+    trees = []
+    for filename in args[1:]:
+        trees += list(treebanks.generate_trees(filename, allow_empty_labels=True))
+    if options['one_per_line']:
+        texts = [str(tree) for tree in trees]
+    else:
+        texts = [indented(tree) for tree in trees]
+
+    with tempfile.NamedTemporaryFile('w', suffix='.mrg', delete=False) as out:
+        for _ in range(options['copies']):
+            for text in texts:
+                print(text, file=out)
+        filename = out.name
+    size = os.path.getsize(filename)
+
+    print("{} trees, {:.2f} MB".format(len(texts) * options['copies'], size / 1e6))
+    print("{:<20} {:>10} {:>10}".format('reader', 'seconds', 'MB/s'))
+    readers = [
+        ('split, previous', split_by_character),
+        ('split in blocks', split_in_blocks),
+        ('read by character', read_by_character),
+        ('read in blocks', read_in_blocks),
+    ]
+    try:
+        for name, reader in readers:
+            start = time.time()
+            reader(filename)
+            seconds = time.time() - start
+            print("{:<20} {:>10.3f} {:>10.2f}".format(name, seconds, size / seconds / 1e6))
+    finally:
+        os.remove(filename)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 noet:
+
+'''Combine the output of runs over shards of a corpus (made with --shard i/N)
+into the files a single run over the whole corpus would have produced.'''
+
+import sys
+import json
+from collections import defaultdict
+
+from nlp_util import init, nlp_eval
+from transform_search import write_results
+
+def read_summaries(shard_prefixes):
+    '''Load the summary each shard wrote to <prefix>.shard, and check that
+    together they form one complete run, returning them in order.
+
+    >>> import os, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> def write_shard(name, shard, files, options):
+    ...     with open(os.path.join(directory, name + '.shard'), 'w') as out:
+    ...         json.dump({'kind': 'analysis', 'shard': shard, 'names': [''],
+    ...             'settings': [files + [os.path.join(directory, name)], options]}, out)
+    >>> write_shard('b', [2, 2], ['wsj.mrg', 'berkeley.mrg'], [['search', 'greedy'], ['shard', '2/2']])
+    >>> write_shard('a', [1, 2], ['wsj.mrg', 'berkeley.mrg'], [['search', 'greedy'], ['shard', '1/2']])
+    >>> success, summaries = read_summaries([os.path.join(directory, name) for name in 'ba'])
+    >>> success, [summary['shard'] for summary in summaries]
+    (True, [[1, 2], [2, 2]])
+    >>> read_summaries([os.path.join(directory, 'a')])[1]
+    'Expected one of each shard from 1/2 to 2/2'
+    >>> write_shard('c', [2, 2], ['wsj.mrg', 'berkeley.mrg'], [['search', 'beam'], ['shard', '2/2']])
+    >>> print(read_summaries([os.path.join(directory, name) for name in 'ac'])[1].replace(directory, 'DIR'))
+    Shards DIR/a and DIR/c are from different kinds of run
+    >>> write_shard('d', [2, 2], ['wsj.mrg', 'charniak.mrg'], [['search', 'greedy'], ['shard', '2/2']])
+    >>> print(read_summaries([os.path.join(directory, name) for name in 'ad'])[1].replace(directory, 'DIR'))
+    Shards DIR/a and DIR/d are for different gold or test files
+    '''
+    summaries = []
+    for prefix in shard_prefixes:
+        try:
+            with open(prefix + '.shard') as src:
+                summary = json.load(src)
+        except (IOError, ValueError):
+            return (False, "No shard summary in {}.shard".format(prefix))
+        summary['prefix'] = prefix
+        summaries.append(summary)
+    summaries.sort(key=lambda summary: summary['shard'][0])
+    count = summaries[0]['shard'][1]
+    if [summary['shard'] for summary in summaries] != [[i, count] for i in range(1, count + 1)]:
+        return (False, "Expected one of each shard from 1/{} to {}/{}".format(count, count, count))
+    first = summaries[0]
+    for summary in summaries:
+        # The caches used do not affect the output
+        options = [option for option in summary['settings'][1] if option[0] not in ['shard', 'cache']]
+        first_options = [option for option in first['settings'][1] if option[0] not in ['shard', 'cache']]
+        if summary['kind'] != first['kind'] or summary['names'] != first['names'] or options != first_options:
+            return (False, "Shards {} and {} are from different kinds of run".format(first['prefix'], summary['prefix']))
+        # The arguments are the input files followed by the shard's own prefix
+        if summary['settings'][0][:-1] != first['settings'][0][:-1]:
+            return (False, "Shards {} and {} are for different gold or test files".format(first['prefix'], summary['prefix']))
+    return (True, summaries)
+
+
+def copy_sentences(prefix, summaries, argv):
+    '''Start each output file with a new header (if the shards had one) and
+    whatever preceded the first sentence in the first shard, followed by the
+    sentences from every shard in order.  Returns the open files, for the
+    output that comes after the sentences.'''
+    first = summaries[0]
+    out_dicts = []
+    for i, name in enumerate(first['names']):
+        out_dict = {}
+        for key, extension in first['files']:
+            out = open(prefix + name + extension, 'w')
+            if first['headers'][i][key] > 0:
+                init.header(argv, [out])
+            out.flush()
+            parts = [(first, first['headers'][i][key], first['starts'][i][key])]
+            for summary in summaries:
+                parts.append((summary, summary['starts'][i][key], summary['ends'][i][key]))
+            for summary, start, end in parts:
+                with open(summary['prefix'] + name + extension, 'rb') as src:
+                    src.seek(start)
+                    out.buffer.write(src.read(end - start))
+            out_dict[key] = out
+        out_dicts.append(out_dict)
+    return out_dicts
+
+
+def first_notes(summaries):
+    '''Notes on how the input ended, from the first shard that reached the
+    end.'''
+    for summary in summaries:
+        if len(summary['notes']) > 0:
+            return summary['notes']
+    return []
+
+
+def merge_analysis(prefix, summaries, out_dicts):
+    '''Write what comes after the sentences in an analysis, combining the
+    error counts, cache counts and stats of the shards (as checked by
+    read_summaries).
+
+    >>> shard = {'names': [''], 'notes': [], 'stats_rows': [[]],
+    ...     'settings': [['wsj.mrg', 'berkeley.mrg', 'out'], [['cache', 'cache_dir'], ['stats', False]]]}
+    >>> first = dict(shard, firsts=[[1, 0, 'key1', True], [2, 0, 'key2', False]],
+    ...     error_counts=[{'Attachment': [2]}], cached=[1], repeated=[0])
+    >>> second = dict(shard, firsts=[[3, 0, 'key1', True]], notes=['End of both input files'],
+    ...     error_counts=[{'Attachment': [1], 'Different label': [1]}], cached=[1], repeated=[0])
+    >>> merge_analysis('out', [first, second], [{'err': sys.stdout, 'error_counts': sys.stdout}])
+    End of both input files
+    1 sentences from the cache, 1 repeated in the input
+    2 3 Attachment
+    1 1 Different label
+    '''
+    first = summaries[0]
+    error_counts = [defaultdict(lambda: []) for out_dict in out_dicts]
+    cached = [0 for out_dict in out_dicts]
+    repeated = [0 for out_dict in out_dicts]
+    stats_rows = [[] for out_dict in out_dicts]
+    seen = set()
+    for summary in summaries:
+        # A pair first seen in this shard, but also in an earlier one, would
+        # have been a repeat in a single run, and not searched or cached
+        repeats = set()
+        for sent_no, i, key, was_cached in summary['firsts']:
+            if key in seen:
+                repeats.add((sent_no, i))
+                repeated[i] += 1
+                cached[i] -= was_cached
+            seen.add(key)
+        for i in range(len(out_dicts)):
+            for error, brackets in summary['error_counts'][i].items():
+                error_counts[i][error] += brackets
+            cached[i] += summary['cached'][i]
+            repeated[i] += summary['repeated'][i]
+            for row in summary['stats_rows'][i]:
+                if (row[0], i) not in repeats:
+                    stats_rows[i].append(row)
+    prefixes = [prefix + name for name in first['names']]
+    options = dict(first['settings'][1])
+    write_results(prefix, prefixes, out_dicts, first_notes(summaries), error_counts, cached, repeated, stats_rows, options)
+
+
+def merge_coloured(prefix, summaries, out_dicts):
+    out = out_dicts[0]
+    for note in first_notes(summaries):
+        print(note, file=out['err'])
+    match, gold, test = [sum(summary['totals'][i] for summary in summaries) for i in range(3)]
+    p, r, f = nlp_eval.calc_prf(match, gold, test)
+    print("Overall %s: %.2f  %.2f  %.2f" % ('out', p*100, r*100, f*100), file=out['out'])
+    print('\\end{document}', file=out['tex'])
+
+
+if __name__ == '__main__':
+    init.argcheck(sys.argv, 3, -1, 'Combine the output of runs over shards of a corpus', '<prefix_for_output_files> <shard_prefix> [<shard_prefix> ...]',
+        'Each shard prefix is the output prefix of a run of classify_english.py,\n'
+        'classify_chinese.py or print_coloured_errors.py with --shard i/N.')
+    success, summaries = read_summaries(sys.argv[2:])
+    if not success:
+        print(summaries, file=sys.stderr)
+        sys.exit(1)
+    out_dicts = copy_sentences(sys.argv[1], summaries, sys.argv)
+    if summaries[0]['kind'] == 'analysis':
+        merge_analysis(sys.argv[1], summaries, out_dicts)
+    else:
+        merge_coloured(sys.argv[1], summaries, out_dicts)
+    for out_dict in out_dicts:
+        for out in out_dict.values():
+            out.close()
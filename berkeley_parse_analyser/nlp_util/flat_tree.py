@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 noet:
+
+'''A compact, read-only tree, for trees that are kept in memory but never
+changed (such as gold trees).  Nodes are stored in pre-order in flat arrays,
+and are accessed through light views with the same interface as PSTree, so
+code that reads PSTrees can read these too.
+
+>>> gold = pstree.tree_from_text("(ROOT (S (NP (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti))) (. .)))")
+>>> test = pstree.tree_from_text("(ROOT (S (NP (NNP Ms.)) (VP (NNP Haag) (VBZ plays) (NP (NNP Elianti))) (. .)))")
+>>> flat = FlatTree.from_pstree(gold)
+>>> print(flat.root())
+(ROOT (S (NP (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti))) (. .)))
+>>> len(flat)
+10
+>>> [(error[0], error[1], error[2]) for error in parse_errors.get_errors(test, flat.root())]
+[('extra', (0, 1), 'NP'), ('extra', (1, 4), 'VP'), ('crossing', (0, 2), 'NP'), ('missing', (2, 4), 'VP')]
+>>> parse_errors.counts_for_prf(test, flat.root()) == parse_errors.counts_for_prf(test, gold)
+True
+>>> head_finder.collins_find_heads(flat.root())[((0, 5), 'S')]
+((2, 3), 'plays', 'VBZ')
+>>> render_tree.text_coloured_errors(test, flat.root()) == render_tree.text_coloured_errors(test, gold)
+True
+>>> print(flat.to_pstree())
+(ROOT (S (NP (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti))) (. .)))
+'''
+
+from array import array
+import sys
+
+from . import pstree, parse_errors, head_finder, render_tree
+
+class FlatTree:
+    '''The nodes of a tree in pre-order, with, for each node, the index of its
+    label in a table of the labels used in the tree, its span, the index of its
+    parent (-1 for the root), the number of nodes in the subtree it heads, and
+    the index of its word in the table of words (-1 for non-terminals).'''
+    __slots__ = ('label_table', 'labels', 'starts', 'ends', 'parents', 'sizes', 'words', 'word_ids')
+
+    def __init__(self):
+        self.label_table = []
+        self.labels = array('H')
+        self.starts = array('i')
+        self.ends = array('i')
+        self.parents = array('i')
+        self.sizes = array('i')
+        self.words = []
+        self.word_ids = array('i')
+
+    @staticmethod
+    def from_pstree(tree):
+        '''Flatten a PSTree.  Labels and words are interned, so that trees in a
+        corpus share them.'''
+        ans = FlatTree()
+        label_ids = {}
+        stack = [(tree, -1)]
+        while stack:
+            node, parent = stack.pop()
+            index = len(ans.labels)
+            label = node.label
+            if label not in label_ids:
+                label_ids[label] = len(ans.label_table)
+                ans.label_table.append(sys.intern(label))
+            ans.labels.append(label_ids[label])
+            ans.starts.append(node.span[0])
+            ans.ends.append(node.span[1])
+            ans.parents.append(parent)
+            ans.sizes.append(1)
+            if node.word is None:
+                ans.word_ids.append(-1)
+            else:
+                ans.word_ids.append(len(ans.words))
+                ans.words.append(sys.intern(node.word))
+            for subtree in reversed(node.subtrees):
+                stack.append((subtree, index))
+
+        # Parents come before their descendants, so working backwards each
+        # subtree is complete when it is added to its parent
+        for index in range(len(ans.sizes) - 1, 0, -1):
+            ans.sizes[ans.parents[index]] += ans.sizes[index]
+        ans.label_table = tuple(ans.label_table)
+        ans.words = tuple(ans.words)
+        return ans
+
+    def __len__(self):
+        return len(self.labels)
+
+    def root(self):
+        return FlatNode(self, 0)
+
+    def to_pstree(self):
+        '''A mutable copy of the tree.  Nodes are built straight from the
+        arrays, in pre-order, so each parent exists before its subtrees.'''
+        label_table, words, word_ids, parents = self.label_table, self.words, self.word_ids, self.parents
+        nodes = []
+        for index in range(len(self.labels)):
+            word_id = word_ids[index]
+            word = None if word_id < 0 else words[word_id]
+            span = (self.starts[index], self.ends[index])
+            parent = parents[index]
+            if parent < 0:
+                node = pstree.PSTree(word, label_table[self.labels[index]], span)
+            else:
+                node = pstree.PSTree(word, label_table[self.labels[index]], span, nodes[parent])
+                nodes[parent].subtrees.append(node)
+            nodes.append(node)
+        return nodes[0]
+
+
+class FlatNode:
+    '''A view of one node in a FlatTree, with the read-only parts of the PSTree
+    interface.  Views of the same node are equal.'''
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    @property
+    def label(self):
+        return self.tree.label_table[self.tree.labels[self.index]]
+
+    @property
+    def span(self):
+        return (self.tree.starts[self.index], self.tree.ends[self.index])
+
+    @property
+    def word(self):
+        word_id = self.tree.word_ids[self.index]
+        if word_id < 0:
+            return None
+        return self.tree.words[word_id]
+
+    @property
+    def parent(self):
+        parent = self.tree.parents[self.index]
+        if parent < 0:
+            return None
+        return FlatNode(self.tree, parent)
+
+    @property
+    def subtrees(self):
+        ans = []
+        sizes = self.tree.sizes
+        child = self.index + 1
+        end = self.index + sizes[self.index]
+        while child < end:
+            ans.append(FlatNode(self.tree, child))
+            child += sizes[child]
+        return ans
+
+    def __iter__(self):
+        '''Nodes in the subtree in pre-order, which is the order they are
+        stored in.'''
+        for index in range(self.index, self.index + self.tree.sizes[self.index]):
+            yield FlatNode(self.tree, index)
+
+    def __eq__(self, other):
+        return isinstance(other, FlatNode) and self.tree is other.tree and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.tree), self.index))
+
+    def is_terminal(self):
+        return self.tree.sizes[self.index] == 1
+
+    def is_trace(self):
+        return self.label == pstree.TRACE_LABEL
+
+    def root(self):
+        return FlatNode(self.tree, 0)
+
+    # These only read the tree, so the PSTree versions work on views too
+    # (clone gives a PSTree)
+    __repr__ = pstree.PSTree.__repr__
+    clone = pstree.PSTree.clone
+    production_list = pstree.PSTree.production_list
+    word_yield = pstree.PSTree.word_yield
+    node_dict = pstree.PSTree.node_dict
+    get_nodes = pstree.PSTree.get_nodes
+    get_spanning_nodes = pstree.PSTree.get_spanning_nodes
+
+
+if __name__ == '__main__':
+    print("Running doctest")
+    import doctest
+    doctest.testmod()
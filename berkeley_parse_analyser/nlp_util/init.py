@@ -26,14 +26,146 @@ def header(args, out=sys.stdout):
         #sys.exit(1)
 
 def argcheck(argv, minargs, maxargs, desc, arg_desc, further_desc=''):
-    if minargs <= len(argv) <= maxargs:
+    '''Exit with a usage message unless argv has from minargs to maxargs
+    entries (with no upper limit if maxargs is -1).'''
+    if minargs <= len(argv) and (maxargs < 0 or len(argv) <= maxargs):
         return
     print("{}\n  {} {}".format(desc, argv[0], arg_desc), file=sys.stderr)
     if len(further_desc) > 0:
         print("\n{}".format(further_desc), file=sys.stderr)
-    print("Expected {} to {} args, got:\n{}".format(minargs - 1, maxargs - 1, ' '.join(argv)), file=sys.stderr)
+    if maxargs < 0:
+        print("Expected at least {} args, got:\n{}".format(minargs - 1, ' '.join(argv)), file=sys.stderr)
+    else:
+        print("Expected {} to {} args, got:\n{}".format(minargs - 1, maxargs - 1, ' '.join(argv)), file=sys.stderr)
     sys.exit(1)
 
+def get_options(argv, options):
+    '''Take options of the form --name value out of argv.  options maps each
+    name to its default value, and given values are converted to the type of
+    the default (or left as strings if the default is None).  Options with a
+    boolean default are flags and take no value.
+
+    A missing value, or one that does not convert, exits with a description
+    of the options, as argcheck does for the wrong number of arguments.
+
+    >>> get_options(['prog', '--workers', '4', 'gold', '--resume', 'test'], {'workers': 1, 'resume': False})
+    (['prog', 'gold', 'test'], {'workers': 4, 'resume': True})
+    >>> get_options(['prog', 'gold', '--workers'], {'workers': 1})
+    Traceback (most recent call last):
+    ...
+    SystemExit: 1
+    >>> get_options(['prog', '--workers', 'two', 'gold'], {'workers': 1})
+    Traceback (most recent call last):
+    ...
+    SystemExit: 1
+    '''
+    args = []
+    values = dict(options)
+    i = 0
+    while i < len(argv):
+        name = argv[i][2:]
+        if argv[i].startswith('--') and name in options:
+            if isinstance(options[name], bool):
+                values[name] = True
+            else:
+                i += 1
+                if i == len(argv):
+                    option_error(argv, options, "No value given for --{}".format(name))
+                values[name] = argv[i]
+                if options[name] is not None:
+                    try:
+                        values[name] = type(options[name])(argv[i])
+                    except ValueError:
+                        option_error(argv, options, "Invalid value {} for --{}, expected {}".format(
+                            argv[i], name, type(options[name]).__name__))
+        else:
+            args.append(argv[i])
+        i += 1
+    return args, values
+
+def option_error(argv, options, message):
+    '''Exit after describing a problem with the options for get_options, and
+    the options there are.'''
+    print(message, file=sys.stderr)
+    print("Options (with their defaults):", file=sys.stderr)
+    for name in sorted(options):
+        if isinstance(options[name], bool):
+            print("  --{}".format(name), file=sys.stderr)
+        else:
+            print("  --{} {}".format(name, 'VALUE' if options[name] is None else options[name]), file=sys.stderr)
+    print("Got:\n{}".format(' '.join(argv)), file=sys.stderr)
+    sys.exit(1)
+
+def get_shard(text):
+    '''Read a shard given as i/N, the i-th of N parts of the input (counting
+    from one).
+
+    >>> get_shard('2/4')
+    (True, (2, 4))
+    >>> get_shard('5/4')
+    (False, 'Invalid shard 5/4, expected i/N with i from 1 to N')
+    '''
+    parts = text.split('/')
+    message = "Invalid shard {}, expected i/N with i from 1 to N".format(text)
+    if len(parts) != 2 or not (parts[0].isdigit() and parts[1].isdigit()):
+        return (False, message)
+    index, count = int(parts[0]), int(parts[1])
+    if not 1 <= index <= count:
+        return (False, message)
+    return (True, (index, count))
+
+def shard_range(shard, total):
+    '''The first and last item (counting from one) in a shard of a total
+    number of items.  Shards are consecutive and differ in size by at most one.
+
+    >>> [shard_range((i, 3), 10) for i in [1, 2, 3]]
+    [(1, 3), (4, 6), (7, 10)]
+    '''
+    index, count = shard
+    return (index - 1) * total // count + 1, index * total // count
+
+def get_sentences(text):
+    '''Read a list of sentence numbers and ranges (counting from one), such as
+    3,10-12,50-, where a range with no end runs to the end of the input.
+
+    >>> get_sentences('41207')
+    (True, [(41207, 41207)])
+    >>> get_sentences('3,10-12,50-')
+    (True, [(3, 3), (10, 12), (50, None)])
+    >>> get_sentences('3,12-10')
+    (False, 'Invalid sentences 3,12-10, expected numbers or ranges like 3,10-12,50-')
+    '''
+    message = "Invalid sentences {}, expected numbers or ranges like 3,10-12,50-".format(text)
+    ans = []
+    for part in text.split(','):
+        first, dash, last = part.partition('-')
+        if not first.isdigit() or not (last == '' or last.isdigit()):
+            return (False, message)
+        first = int(first)
+        if not dash:
+            last = first
+        elif last == '':
+            last = None
+        else:
+            last = int(last)
+        if first < 1 or (last is not None and last < first):
+            return (False, message)
+        ans.append((first, last))
+    return (True, ans)
+
+def sentence_numbers(ranges, total):
+    '''The numbers in a list of ranges from get_sentences, in order and
+    without repeats, with open ranges ending at total.
+
+    >>> list(sentence_numbers([(10, 12), (3, 3), (11, None)], 13))
+    [3, 10, 11, 12, 13]
+    '''
+    cur = 0
+    for first, last in sorted((first, total if last is None else last) for first, last in ranges):
+        for number in range(max(first, cur + 1), last + 1):
+            yield number
+        cur = max(cur, last)
+
 if __name__ == "__main__":
     print("Running doctest")
     import doctest
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 noet:
+
+'''A table of the labels seen in trees.  Each label is interned once, and the
+parts of it that tree processing looks at are worked out when it is first
+seen, rather than on every node that has it.
+
+>>> info = label_info('NP-SBJ-1')
+>>> info.base, info.functions, info.is_trace, info.is_punctuation
+('NP', ('SBJ', '1'), False, False)
+>>> label_info('NP-SBJ-1') is info
+True
+>>> label_info('ADVP|PRT').cleaned
+'ADVP'
+>>> intern(''.join(['N', 'P'])) is label_info('NP').text
+True
+'''
+
+import sys
+
+TRACE_LABEL = '-NONE-'
+
+# Punctuation tags that the standard evalb config ignores
+PUNCTUATION_LABELS = set([",", ":", "``", "''", "."])
+
+def split_label_type_and_function(label):
+    parts = label.split('=')
+    if len(label) > 0 and label[0] != '-':
+        cur = parts
+        parts = []
+        for part in cur:
+            parts += part.split('-')
+    return parts
+
+
+class LabelInfo:
+    '''A label, with its base category (without function tags or indices),
+    the function tags and indices, whether it marks a trace or punctuation, and
+    the label it is cleaned to if it gives alternatives (e.g. ADVP|PRT).'''
+    __slots__ = ('text', 'id', 'base', 'functions', 'is_trace', 'is_punctuation', 'cleaned')
+
+    def __init__(self, text, label_id):
+        self.text = text
+        self.id = label_id
+        parts = split_label_type_and_function(text)
+        self.base = intern(parts[0])
+        self.functions = tuple(parts[1:])
+        self.is_trace = text == TRACE_LABEL
+        self.is_punctuation = text in PUNCTUATION_LABELS
+        self.cleaned = text
+        if '|' in text:
+            if 'ADVP' in text:
+                self.cleaned = intern('ADVP')
+            else:
+                self.cleaned = intern(text.split('|')[0])
+
+    def __repr__(self):
+        return "LabelInfo({})".format(self.text)
+
+
+labels = {}
+
+def label_info(label):
+    '''The LabelInfo for a label, created the first time the label is seen.'''
+    info = labels.get(label)
+    if info is None:
+        label = intern(label)
+        info = LabelInfo(label, len(labels))
+        labels[label] = info
+    return info
+
+def intern(label):
+    '''The single shared copy of a label, so that labels in different trees are
+    the same object (and compare by identity first).'''
+    info = labels.get(label)
+    if info is not None:
+        return info.text
+    return sys.intern(label)
+
+if __name__ == '__main__':
+    print("Running doctest")
+    import doctest
+    doctest.testmod()
@@ -2,6 +2,8 @@
 # -*- coding: utf-8 -*-
 # vim: set ts=2 sw=2 noet:
 
+from .pstree import tree_from_text
+
 class ParseErrorSet:
     def __init__(self, gold=None, test=None, include_terminals=False):
         self.missing = []
@@ -10,11 +12,54 @@ class ParseErrorSet:
         self.POS = []
         self.spans = {}
 
+        # Bracket counts, used to work out the effect of edits without
+        # recomputing the errors from scratch.
+        self.gold_counts = {}
+        self.gold_positions = {}
+        self.gold_nodes = []
+        self.test_counts = {}
+        self.test_span_counts = {}
+        self.test_hash = 0
+
+        # Test spans indexed by start and end, and the gold brackets with no
+        # match in the test tree, indexed the same way, with the number of test
+        # spans that cross each.  With these, missing_after only looks at the
+        # brackets an edit touches.
+        self.test_starts = {}
+        self.test_ends = {}
+        self.unmatched_starts = {}
+        self.unmatched_ends = {}
+        self.crossing_counts = {}
+        self.missing_positions = []
+
         if gold is not None and test is not None:
             errors = get_errors(test, gold, include_terminals)
             for error in errors:
                 self.add_error(error[0], error[1], error[2], error[3])
 
+            for node in get_brackets(gold):
+                key = bracket(node)
+                self.gold_counts[key] = self.gold_counts.get(key, 0) + 1
+                self.gold_positions.setdefault(key, []).append(len(self.gold_nodes))
+                self.gold_nodes.append(node)
+            for node in get_brackets(test):
+                key = bracket(node)
+                self.test_counts[key] = self.test_counts.get(key, 0) + 1
+                self.test_span_counts[node.span] = self.test_span_counts.get(node.span, 0) + 1
+            self.test_hash = brackets_hash(self.test_counts)
+
+            for start, end in self.test_span_counts:
+                self.test_starts.setdefault(start, []).append(end)
+                self.test_ends.setdefault(end, []).append(start)
+            for key, positions in self.gold_positions.items():
+                for position in positions[self.test_counts.get(key, 0):]:
+                    start, end = self.gold_nodes[position].span
+                    self.unmatched_starts.setdefault(start, []).append(position)
+                    self.unmatched_ends.setdefault(end, []).append(position)
+                    self.crossing_counts[position] = self.count_crossing(start, end, {})
+                    if self.crossing_counts[position] == 0:
+                        self.missing_positions.append(position)
+
     def add_error(self, etype, span, label, node):
         error = (etype, span, label, node)
         if span not in self.spans:
@@ -42,6 +87,156 @@ class ParseErrorSet:
     def __len__(self):
         return len(self.missing) + len(self.extra) + len(self.crossing) + (2*len(self.POS))
 
+    def count_change(self, removed, added):
+        '''Work out how the number of errors would change if the test tree had
+        the given brackets removed and added.  Brackets are (start, end, label)
+        tuples, as produced by bracket().  Only the brackets involved in the edit
+        are considered, so the cost does not depend on the size of the tree.'''
+        change = 0
+        for key, diff in bracket_diff(removed, added).items():
+            gold = self.gold_counts.get(key, 0)
+            test = self.test_counts.get(key, 0)
+            change += abs(test + diff - gold) - abs(test - gold)
+        return change
+
+    def hash_after(self, removed, added):
+        '''The brackets_hash the test tree would have after the given brackets
+        were removed and added.'''
+        return brackets_hash(bracket_diff(removed, added), self.test_hash)
+
+    def count_crossing(self, start, end, span_diff):
+        '''Count the test spans that would cross a gold span from start to end
+        after the changes in span_diff (a dict from span to the change in the
+        number of brackets over it), using the index of test spans.'''
+        ans = 0
+        for position in range(start + 1, end):
+            for other in self.test_ends.get(position, ()):
+                if other < start and self.span_count_after((other, position), span_diff) > 0:
+                    ans += 1
+            for other in self.test_starts.get(position, ()):
+                if end < other and self.span_count_after((position, other), span_diff) > 0:
+                    ans += 1
+        for span in span_diff:
+            if span not in self.test_span_counts and self.span_count_after(span, span_diff) > 0:
+                if span[0] < start < span[1] < end or start < span[0] < end < span[1]:
+                    ans += 1
+        return ans
+
+    def span_count_after(self, span, span_diff):
+        return self.test_span_counts.get(span, 0) + span_diff.get(span, 0)
+
+    def unmatched_crossed_by(self, start, end):
+        '''Generate the positions of the unmatched gold brackets that a span
+        from start to end crosses.'''
+        for position in range(start + 1, end):
+            for gold in self.unmatched_starts.get(position, ()):
+                if end < self.gold_nodes[gold].span[1]:
+                    yield gold
+            for gold in self.unmatched_ends.get(position, ()):
+                if self.gold_nodes[gold].span[0] < start:
+                    yield gold
+
+    def missing_after(self, removed, added):
+        '''Get the missing (not crossing) errors there would be after the given
+        brackets were removed from and added to the test tree, in the same order
+        that a new ParseErrorSet would have them.  Apart from building the list,
+        the cost depends on the brackets in the edit, not the size of the tree.
+
+        >>> gold = tree_from_text("(ROOT (S (NP (DT The) (NN cat)) (VP (VBD sat) (PP (IN on) (NP (DT the) (NN mat))))))")
+        >>> test = tree_from_text("(ROOT (S (NP (DT The) (NN cat) (VBD sat)) (PP (IN on) (NP (DT the) (NN mat)))))")
+        >>> errors = ParseErrorSet(gold, test)
+        >>> [(error[0], error[1], error[2]) for error in errors.missing + errors.crossing]
+        [('missing', (0, 2), 'NP'), ('crossing', (2, 6), 'VP')]
+        >>> [(error[1], error[2]) for error in errors.missing_after([(0, 3, 'NP')], [])]
+        [((0, 2), 'NP'), ((2, 6), 'VP')]
+        >>> [(error[1], error[2]) for error in errors.missing_after([(0, 3, 'NP')], [(0, 2, 'NP')])]
+        [((2, 6), 'VP')]
+        '''
+        diff = bracket_diff(removed, added)
+        span_diff = {}
+        for key, count in diff.items():
+            span_diff[key[:2]] = span_diff.get(key[:2], 0) + count
+
+        # Gold brackets the change matches, or leaves unmatched
+        matched = set()
+        unmatched = []
+        for key, count in diff.items():
+            positions = self.gold_positions.get(key, [])
+            before = self.test_counts.get(key, 0)
+            after = max(before + count, 0)
+            matched.update(positions[before:after])
+            unmatched += positions[after:before]
+
+        # Crossing counts for gold brackets crossed by spans that appear or
+        # disappear, and for those the change leaves unmatched
+        counts = {}
+        for span, count in span_diff.items():
+            before = self.test_span_counts.get(span, 0) > 0
+            after = self.span_count_after(span, span_diff) > 0
+            if before != after:
+                change = 1 if after else -1
+                for position in self.unmatched_crossed_by(span[0], span[1]):
+                    counts[position] = counts.get(position, self.crossing_counts[position]) + change
+        for position in unmatched:
+            start, end = self.gold_nodes[position].span
+            counts[position] = self.count_crossing(start, end, span_diff)
+
+        positions = set(position for position in self.missing_positions if position not in counts)
+        positions.update(position for position, count in counts.items() if count == 0)
+        positions.difference_update(matched)
+        ans = []
+        for position in sorted(positions):
+            node = self.gold_nodes[position]
+            ans.append(('missing', node.span, node.label, node))
+        return ans
+
+def bracket(node):
+    '''The (start, end, label) tuple used to compare brackets across trees.'''
+    return (node.span[0], node.span[1], node.label)
+
+def bracket_diff(removed, added):
+    '''Combine lists of removed and added brackets into net count changes.'''
+    diff = {}
+    for key in removed:
+        diff[key] = diff.get(key, 0) - 1
+    for key in added:
+        diff[key] = diff.get(key, 0) + 1
+    return diff
+
+BRACKETS_HASH_MASK = (1 << 64) - 1
+
+def brackets_hash(counts, start=0):
+    '''Hash a multiset of brackets, given as a dict from bracket to count.
+    The hash is a sum over the brackets, so it can be updated for brackets being
+    removed and added by passing the counts of the change, and the hash before
+    it as start.  Trees with the same brackets have the same errors, so within
+    a search this identifies equivalent tree states.
+
+    >>> before = brackets_hash({(0, 2, 'NP'): 1, (0, 3, 'S'): 1})
+    >>> after = brackets_hash({(0, 2, 'NP'): -1, (1, 3, 'VP'): 1}, before)
+    >>> after == brackets_hash({(1, 3, 'VP'): 1, (0, 3, 'S'): 1})
+    True
+    '''
+    for key, count in counts.items():
+        start += bracket_hash(key) * count
+    return start & BRACKETS_HASH_MASK
+
+def bracket_hash(key):
+    '''Scramble the hash of a bracket (with the splitmix64 finaliser).  The
+    built in hash of a tuple is close to linear in its parts, so sums of them
+    collide for brackets shifted by the same amount.'''
+    value = (hash(key) + 0x9E3779B97F4A7C15) & BRACKETS_HASH_MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & BRACKETS_HASH_MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & BRACKETS_HASH_MASK
+    return value ^ (value >> 31)
+
+def get_brackets(tree):
+    '''Get the non-terminal nodes of a tree, sorted by span, with nodes that
+    share a span in pre-order.'''
+    nodes = [node for node in tree if not node.is_terminal()]
+    nodes.sort(key=lambda node: node.span)
+    return nodes
+
 def get_errors(test, gold, include_terminals=False):
     ans = []
 
@@ -133,4 +328,6 @@ def counts_for_prf(test, gold, include_root=False, include_terminals=False):
     return match, gcount, tcount, len(errors.crossing), len(errors.POS)
 
 if __name__ == '__main__':
-    print("No unit testing implemented for Error_Set")
+    print("Running doctest")
+    import doctest
+    doctest.testmod()
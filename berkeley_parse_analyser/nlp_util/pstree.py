@@ -2,9 +2,13 @@
 # -*- coding: utf-8 -*-
 
 from collections import defaultdict
+import re
+import sys
+
+from . import labels
 
 DEFAULT_LABEL = 'label_not_set'
-TRACE_LABEL = '-NONE-'
+TRACE_LABEL = labels.TRACE_LABEL
 
 class TreeIterator:
     '''Iterator for traversal of a tree.
@@ -78,6 +82,10 @@ class PSTree:
     >>> tree.word_yield()
     'was named *-1 a nonexecutive director of this British industrial conglomerate'
     '''
+    # Searches clone trees many times and corpora keep many trees in memory, so
+    # nodes have fixed attributes rather than a per-node __dict__
+    __slots__ = ('word', 'label', 'span', 'parent', 'subtrees')
+
     def __init__(self, word=None, label=DEFAULT_LABEL, span=(0, 0), parent=None, subtrees=None):
         self.word = word
         self.label = label
@@ -92,12 +100,19 @@ class PSTree:
     def __iter__(self):
         return TreeIterator(self, 'pre')
 
+    # The methods below that visit every node use explicit stacks rather than
+    # recursion, as that avoids a Python call per node and works for trees
+    # deeper than the recursion limit.
+
     def clone(self):
         ans = PSTree(self.word, self.label, self.span)
-        for subtree in self.subtrees:
-            subclone = subtree.clone()
-            subclone.parent = ans
-            ans.subtrees.append(subclone)
+        stack = [(self, ans)]
+        while stack:
+            node, copy = stack.pop()
+            for subtree in node.subtrees:
+                subclone = PSTree(subtree.word, subtree.label, subtree.span, copy)
+                copy.subtrees.append(subclone)
+                stack.append((subtree, subclone))
         return ans
 
     def is_terminal(self):
@@ -110,52 +125,75 @@ class PSTree:
 
     def root(self):
         '''Follow parents until a node is reached that has no parent.'''
-        if self.parent is not None:
-            return self.parent.root()
-        else:
-            return self
+        node = self
+        while node.parent is not None:
+            node = node.parent
+        return node
 
     def __repr__(self):
         '''Return a bracket notation style representation of the tree.'''
-        ans = '('
-        if self.is_trace():
-            ans += TRACE_LABEL + ' ' + self.word
-        elif self.is_terminal():
-            ans += self.label + ' ' + self.word
-        else:
-            ans += self.label
-        for subtree in self.subtrees:
-            ans += ' ' + subtree.__repr__()
-        ans += ')'
-        return ans
+        parts = []
+        stack = [('(', self)]
+        while stack:
+            prefix, node = stack.pop()
+            if node is None:
+                parts.append(')')
+                continue
+            if node.is_trace():
+                parts.append(prefix + TRACE_LABEL + ' ' + node.word)
+            elif node.is_terminal():
+                parts.append(prefix + node.label + ' ' + node.word)
+            else:
+                parts.append(prefix + node.label)
+            stack.append((None, None))
+            for subtree in reversed(node.subtrees):
+                stack.append((' (', subtree))
+        return ''.join(parts)
 
     def calculate_spans(self, left=0):
         '''Update the spans for every node in this tree.'''
         right = left
-        if self.is_terminal():
-            right += 1
-        for subtree in self.subtrees:
-            right = subtree.calculate_spans(right)
-        self.span = (left, right)
+        # Nodes are pushed with None, and again with their start once their
+        # subtrees are on the stack, to be given a span when those are done
+        stack = [(self, None)]
+        while stack:
+            node, start = stack.pop()
+            if start is None:
+                stack.append((node, right))
+                if node.is_terminal():
+                    right += 1
+                for subtree in reversed(node.subtrees):
+                    stack.append((subtree, None))
+            else:
+                node.span = (start, right)
         return right
 
     def check_consistency(self):
         '''Check that the parents and spans are consistent with the tree
-        structure.'''
+        structure.  Once a problem is found, subtrees that have not been
+        reached yet are not checked.'''
         ans = True
-        if len(self.subtrees) > 0:
-            for i in range(len(self.subtrees)):
-                subtree = self.subtrees[i]
-                if subtree.parent != self:
+        stack = [[self, 0]]
+        while stack:
+            frame = stack[-1]
+            node, i = frame
+            if i < len(node.subtrees):
+                frame[1] += 1
+                subtree = node.subtrees[i]
+                if subtree.parent != node:
                     print("bad parent link")
                     ans = False
-                if i > 0 and self.subtrees[i - 1].span[1] != subtree.span[0]:
+                if i > 0 and node.subtrees[i - 1].span[1] != subtree.span[0]:
                     print("Subtree spans don't match")
                     ans = False
-                ans = ans and subtree.check_consistency()
-            if self.span != (self.subtrees[0].span[0], self.subtrees[-1].span[1]):
-                print("Span doesn't match subtree spans")
-                ans = False
+                if ans:
+                    stack.append([subtree, 0])
+            else:
+                stack.pop()
+                if len(node.subtrees) > 0:
+                    if node.span != (node.subtrees[0].span[0], node.subtrees[-1].span[1]):
+                        print("Span doesn't match subtree spans")
+                        ans = False
         return ans
 
     def production_list(self, ans=None):
@@ -163,48 +201,63 @@ class PSTree:
         (node label, node span, ((subtree1, end1), (subtree2, end2)...))'''
         if ans is None:
             ans = []
-        if len(self.subtrees) > 0:
-            cur = (self.label, self.span, tuple([(sub.label, sub.span[1]) for sub in self.subtrees]))
-            ans.append(cur)
-            for sub in self.subtrees:
-                sub.production_list(ans)
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            subtrees = node.subtrees
+            if len(subtrees) > 0:
+                cur = (node.label, node.span, tuple([(sub.label, sub.span[1]) for sub in subtrees]))
+                ans.append(cur)
+                stack.extend(reversed(subtrees))
         return ans
 
     def word_yield(self, span=None, as_list=False):
         '''Return the set of words at terminal nodes, either as a space separated
         string, or as a list.'''
-        if self.is_terminal():
-            if span is None or span[0] <= self.span[0] < span[1]:
-                if self.word is None:
-                    return None
+        # Each node contributes its words, or None, to the parts of its parent.
+        # Note that a non-terminal with no words in the span contributes an
+        # empty string.
+        ans = None
+        parts = [[]]
+        stack = [(self, False)]
+        while stack:
+            node, done = stack.pop()
+            if node.is_terminal():
+                ans = None
+                if span is None or span[0] <= node.span[0] < span[1]:
+                    if node.word is not None:
+                        ans = [node.word] if as_list else node.word
+            elif not done:
+                parts.append([])
+                stack.append((node, True))
+                for subtree in reversed(node.subtrees):
+                    stack.append((subtree, False))
+                continue
+            else:
+                subparts = parts.pop()
+                ans = subparts if as_list else ' '.join(subparts)
+            if ans is not None:
                 if as_list:
-                    return [self.word]
+                    parts[-1] += ans
                 else:
-                    return self.word
-            else:
-                return None
-        else:
-            subparts = []
-            for subtree in self.subtrees:
-                words = subtree.word_yield(span, as_list)
-                if words is not None:
-                    if as_list:
-                        subparts += words
-                    else:
-                        subparts.append(words)
-            if as_list:
-                return subparts
-            else:
-                return ' '.join(subparts)
+                    parts[-1].append(ans)
+        return ans
 
     def node_dict(self, depth=0, node_dict=None):
         '''Get a dictionary of labelled nodes. Note that we use a dictionary to
         take into consideration unaries like (NP (NP ...))'''
         if node_dict is None:
             node_dict = defaultdict(lambda: [])
-        for subtree in self.subtrees:
-            subtree.node_dict(depth + 1, node_dict)
-        node_dict[(self.label, self.span[0], self.span[1])].append(depth)
+        # Nodes are added after their subtrees
+        stack = [(self, depth, False)]
+        while stack:
+            node, node_depth, done = stack.pop()
+            if done:
+                node_dict[(node.label, node.span[0], node.span[1])].append(node_depth)
+            else:
+                stack.append((node, node_depth, True))
+                for subtree in reversed(node.subtrees):
+                    stack.append((subtree, node_depth + 1, False))
         return node_dict
 
     def get_nodes(self, request='all', start=-1, end=-1, node_list=None):
@@ -218,27 +271,33 @@ class PSTree:
 
         if request == 'all' and node_list is None:
             node_list = []
-        if request == 'highest':
-            if self.span[0] == start or start < 0:
-                if self.span[1] == end or end < 0:
-                    return self
-
-        for subtree in self.subtrees:
-            # Skip subtrees with no overlapping range
-            if 0 < end <= subtree.span[0] or subtree.span[1] < start:
+
+        # Nodes are visited before their subtrees (for 'highest') and again
+        # after them (for 'lowest' and 'all')
+        found = []
+        stack = [(self, False)]
+        while stack:
+            node, done = stack.pop()
+            matches = (node.span[0] == start or start < 0) and (node.span[1] == end or end < 0)
+            if done:
+                if matches:
+                    if request == 'lowest':
+                        return node
+                    found.append(node)
                 continue
-            ans = subtree.get_nodes(request, start, end, node_list)
-            if ans is not None and request != 'all':
-                return ans
+            if request == 'highest' and matches:
+                return node
+            stack.append((node, True))
+            for subtree in reversed(node.subtrees):
+                # Skip subtrees with no overlapping range
+                if 0 < end <= subtree.span[0] or subtree.span[1] < start:
+                    continue
+                stack.append((subtree, False))
 
-        if self.span[0] == start or start < 0:
-            if self.span[1] == end or end < 0:
-                if request == 'lowest':
-                    return self
-                elif request == 'all':
-                    node_list.insert(0, self)
-                    return node_list
         if request == 'all':
+            # Each node goes before the nodes found in its subtrees
+            found.reverse()
+            node_list[0:0] = found
             return node_list
         else:
             return None
@@ -268,41 +327,215 @@ class PSTree:
         else:
             return start
 
+class SpanIndex:
+    '''An index from spans, and from spans and labels, to the nodes of a tree,
+    in the order get_nodes gives them (highest first).  Operations in
+    tree_transform keep it up to date if it is passed to them.
+
+    >>> tree = tree_from_text("(ROOT (S (NP (NP (NNP Ms.) (NNP Haag))) (VP (VBZ plays) (NP (NNP Elianti)))))")
+    >>> index = SpanIndex(tree)
+    >>> index.nodes((0, 2))
+    [(NP (NP (NNP Ms.) (NNP Haag))), (NP (NNP Ms.) (NNP Haag))]
+    >>> index.find((0, 2), 'NP') == tree.get_nodes('all', 0, 2)
+    True
+    >>> index.lowest((2, 3))
+    (VBZ plays)
+    >>> print(index.lowest((1, 3)))
+    None
+    '''
+    def __init__(self, tree):
+        self.by_span = {}
+        self.by_bracket = {}
+        self.keys = {}
+        for node in tree.root():
+            self.add(node)
+
+    def nodes(self, span):
+        '''The nodes with a span, highest first.'''
+        return self.by_span.get(span, [])
+
+    def find(self, span, label):
+        '''The nodes with a span and label, highest first.'''
+        return self.by_bracket.get((span[0], span[1], label), [])
+
+    def lowest(self, span):
+        nodes = self.by_span.get(span)
+        return nodes[-1] if nodes else None
+
+    def highest(self, span):
+        nodes = self.by_span.get(span)
+        return nodes[0] if nodes else None
+
+    def add(self, node):
+        span = node.span
+        key = (span[0], span[1], node.label)
+        self.keys[node] = key
+        for table, table_key in [(self.by_span, span), (self.by_bracket, key)]:
+            nodes = table.setdefault(table_key, [])
+            nodes.append(node)
+            if len(nodes) > 1:
+                # Nodes with the same span are a chain of unaries
+                nodes.sort(key=depth)
+
+    def discard(self, node):
+        key = self.keys.pop(node, None)
+        if key is not None:
+            for table, table_key in [(self.by_span, key[:2]), (self.by_bracket, key)]:
+                table[table_key].remove(node)
+                if len(table[table_key]) == 0:
+                    del table[table_key]
+
+    def refresh(self, node):
+        '''Update the entries for a node, which may have a new span or label,
+        or have been removed from the tree or put back.'''
+        self.discard(node)
+        if is_attached(node):
+            self.add(node)
+
+    def update(self, edit):
+        '''Update the entries for the nodes changed by a tree_transform edit.'''
+        for node in edit.changed_nodes():
+            self.refresh(node)
+
+
+def depth(node):
+    ans = 0
+    while node.parent is not None:
+        node = node.parent
+        ans += 1
+    return ans
+
+def is_attached(node):
+    '''Check that a node is in the subtrees of each of its ancestors (removed
+    nodes keep their parent).'''
+    while node.parent is not None:
+        if not any(subtree is node for subtree in node.parent.subtrees):
+            return False
+        node = node.parent
+    return True
+
 def tree_from_text(text, allow_empty_labels=False, allow_empty_words=False):
     '''Construct a PSTree from the provided string, which is assumed to represent
     a tree with nested round brackets.  Nodes are labeled by the text between the
     open bracket and the next space (possibly an empty string).  Words are the
-    text after that space and before the close bracket.'''
+    text after that space and before the close bracket.
+
+    Text is split into tokens in bulk rather than read a character at a time.
+    Most trees are simple (one word per terminal, single spaces or brackets
+    between tokens), and are read by simple_tree_from_text, while anything
+    else, including any error, is handled by general_tree_from_text.
+
+    >>> tree = tree_from_text("(ROOT (NP (NNP New  York) (NN city) ))")
+    >>> tree, tree.subtrees[0].span, tree.subtrees[0].subtrees[0].word
+    ((ROOT (NP (NNP New  York) (NN city))), (0, 2), 'New  York')
+    >>> tree_from_text("(ROOT (NP dog (NN cat)))")
+    Traceback (most recent call last):
+    ...
+    Exception: Stray 'dog' while processing
+    (ROOT (NP dog (NN cat)))
+    '''
+    tree = simple_tree_from_text(text)
+    if tree is None:
+        tree = general_tree_from_text(text, allow_empty_labels, allow_empty_words)
+    return tree
+
+def simple_tree_from_text(text):
+    '''Construct a PSTree from text in which every word is one token, and
+    labels are never empty, giving None if the text is not like that.  The
+    result is the same as general_tree_from_text would give.'''
+    text = text.strip()
+    # Only spaces separate tokens (other whitespace can be part of labels and
+    # words), and an open bracket must be followed by a label
+    if not text.isprintable() or '( ' in text:
+        return None
+
+    # Trees are added under a placeholder, which also means text before and
+    # between trees is skipped, and the last tree is returned.  Labels are
+    # interned with sys.intern, which gives the same strings as labels.intern.
+    top = PSTree()
+    cur = top
+    pos = 0
+    tokens = iter(text.replace('(', ' ( ').replace(')', ' ) ').split())
+    for token in tokens:
+        if token == '(':
+            label = next(tokens, ')')
+            word = next(tokens, ')')
+            while word == '(':
+                if label in '()':
+                    return None
+                node = PSTree(None, sys.intern(label), (0, 0), cur)
+                cur.subtrees.append(node)
+                cur = node
+                label = next(tokens, ')')
+                word = next(tokens, ')')
+            if label in '()' or word == ')' or next(tokens, None) != ')':
+                return None
+            cur.subtrees.append(PSTree(word, sys.intern(label), (pos, pos + 1), cur))
+            pos += 1
+        elif token == ')':
+            if cur is not top:
+                subtrees = cur.subtrees
+                cur.span = (subtrees[0].span[0], subtrees[-1].span[1])
+                cur = cur.parent
+        elif cur is not top:
+            return None
+    if cur is not top or len(top.subtrees) == 0:
+        return None
+    root = top.subtrees[-1]
+    root.parent = None
+    return root
+
+# Splits text into the parts between brackets and the brackets themselves
+TREE_TOKENS = re.compile(r'([()])')
+
+def general_tree_from_text(text, allow_empty_labels=False, allow_empty_words=False):
+    '''Construct a PSTree from any text, splitting it at brackets and handling
+    each part between brackets in one step.'''
     root = None
     cur = None
     pos = 0
     word = ''
-    for char in text:
+    parts = TREE_TOKENS.split(text)
+    # Parts alternate between text and brackets, starting and ending with text
+    brackets = parts[1::2]
+    brackets.append(None)
+    for part, bracket in zip(parts[0::2], brackets):
         # Consume random text up to the first '('
         if cur is None:
-            if char == '(':
+            if bracket == '(':
                 root = PSTree()
                 cur = root
             continue
 
-        if char == '(':
+        # Up to the first space is the label, if it has not been set, and the
+        # rest is the word (a word before an open bracket is an error)
+        if cur.label is DEFAULT_LABEL:
+            space = part.find(' ')
+            if space < 0:
+                word = part
+            else:
+                if space == 0 and not allow_empty_labels:
+                    raise Exception("Empty label found\n%s" % text)
+                cur.label = labels.intern(part[:space])
+                word = part[space + 1:]
+        else:
+            word = part
+
+        if bracket == '(':
             word = word.strip()
             if cur.label is DEFAULT_LABEL:
                 if len(word) == 0 and not allow_empty_labels:
                     raise Exception("Empty label found\n%s" % text)
-                cur.label = word
+                cur.label = labels.intern(word)
                 word = ''
             if word != '':
                 raise Exception("Stray '%s' while processing\n%s" % (word, text))
-            sub = PSTree()
+            sub = PSTree(None, DEFAULT_LABEL, (0, 0), cur)
             cur.subtrees.append(sub)
-            sub.parent = cur
             cur = sub
-        elif char == ')':
+        elif bracket == ')':
             word = word.strip()
             if word != '':
-                if len(word) == 0 and not allow_empty_words:
-                    raise Exception("Empty word found\n%s" % text)
                 cur.word = word
                 word = ''
                 cur.span = (pos, pos + 1)
@@ -310,21 +543,10 @@ def tree_from_text(text, allow_empty_labels=False, allow_empty_words=False):
             else:
                 cur.span = (cur.subtrees[0].span[0], cur.subtrees[-1].span[1])
             cur = cur.parent
-        elif char == ' ':
-            if cur.label is DEFAULT_LABEL:
-                if len(word) == 0 and not allow_empty_labels:
-                    raise Exception("Empty label found\n%s" % text)
-                cur.label = word
-                word = ''
-            else:
-                word += char
-        else:
-            word += char
     if cur is not None:
         raise Exception("Text did not include complete tree\n%s" % text)
     return root
 
-
 def clone_and_find(nodes):
     '''Clone the tree these nodes are in and finds the equivalent nodes in the
     new tree.'''
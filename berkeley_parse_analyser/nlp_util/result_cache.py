@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 noet:
+
+'''A persistent store of results, addressed by a hash of everything that
+determines them, so that repeating an analysis on unchanged input is a lookup.
+
+>>> import tempfile
+>>> cache = ResultCache(tempfile.mkdtemp())
+>>> key = make_key('some', 'input')
+>>> print(cache.get(key))
+None
+>>> cache.put(key, {'answer': [4, 2]})
+>>> cache.get(key)
+{'answer': [4, 2]}
+>>> cache.hits, cache.misses
+(1, 1)
+'''
+
+import hashlib
+import json
+import os
+import tempfile
+
+def make_key(*parts):
+    '''Hash a sequence of strings.  Parts are length prefixed, so different
+    splits of the same text give different keys.
+
+    >>> make_key('a', 'b') == make_key('a', 'b')
+    True
+    >>> make_key('ab', '') == make_key('a', 'b')
+    False
+    '''
+    digest = hashlib.sha256()
+    for part in parts:
+        part = part.encode('utf-8')
+        digest.update("{}:".format(len(part)).encode('utf-8'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def source_version(filenames):
+    '''Hash the contents of a set of files, for use as a version in keys, so
+    that results are recomputed when the code that produces them changes.'''
+    parts = []
+    for filename in sorted(filenames):
+        with open(filename, 'rb') as src:
+            parts.append(hashlib.sha256(src.read()).hexdigest())
+    return make_key(*parts)
+
+
+# The umask, for the permissions of written files.  Reading it means setting
+# it, which would affect files other threads create at the same time, so it is
+# read once, on import.
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+def write_json(filename, value):
+    '''Write value to a file as JSON, under a temporary name that is then
+    renamed, so readers never see part of a value and an interrupted write
+    leaves any earlier version in place.  mkstemp makes files only the owner
+    can read, so the file is given the permissions open would have used.
+
+    >>> import tempfile
+    >>> filename = os.path.join(tempfile.mkdtemp(), 'value.json')
+    >>> write_json(filename, [4, 2])
+    >>> os.stat(filename).st_mode & 0o777 == 0o666 & ~UMASK
+    True
+    '''
+    directory = os.path.dirname(os.path.abspath(filename))
+    handle, tmp_name = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'w') as out:
+        json.dump(value, out)
+    os.chmod(tmp_name, 0o666 & ~UMASK)
+    os.replace(tmp_name, filename)
+
+
+class ResultCache:
+    '''JSON values stored one per file in a directory, spread over
+    subdirectories named by the first two characters of their keys.'''
+    def __init__(self, directory):
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+
+    def filename(self, key):
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+    def get(self, key):
+        '''The value stored for key, or None if there is none (or it cannot be
+        read).'''
+        try:
+            with open(self.filename(key)) as src:
+                value = json.load(src)
+        except (IOError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        '''Store value under key.'''
+        filename = self.filename(key)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        write_json(filename, value)
+
+
+if __name__ == '__main__':
+    print("Running doctest")
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 noet:
+
+'''Random access to the sentences of a file.  One pass over the file records
+where each sentence starts, and this index is saved next to the file (as
+<file>.index) for later runs.  The file is then read through a memory map, so
+getting sentence N only reads sentence N.
+
+A file can be indexed by line (one sentence per line, as the analysis programs
+read their input), as a PTB file (trees over any number of lines, as
+generate_trees reads them), or as a CoNLL file (sentences separated by blank
+lines).  Sentences are numbered from one.
+
+>>> import os, tempfile
+>>> directory = tempfile.mkdtemp()
+>>> filename = os.path.join(directory, 'trees.mrg')
+>>> with open(filename, 'w') as out:
+...     print("(ROOT (NP (NN one)))\\n\\n(ROOT (NP (NN two)\\n  (NN trees)))", file=out)
+>>> lines = TreeIndex(filename)
+>>> len(lines), lines.text(3)
+(4, '(ROOT (NP (NN two)\\n')
+>>> ptb = TreeIndex(filename, 'ptb')
+>>> len(ptb), ptb.tree(2)
+(2, (ROOT (NP (NN two) (NN trees))))
+>>> os.path.exists(filename + '.ptb.index')
+True
+>>> TreeIndex(filename, 'ptb').text(1)
+'(ROOT (NP (NN one)))'
+'''
+
+from array import array
+from io import StringIO
+import json
+import mmap
+import os
+import re
+import sys
+
+from . import treebanks, init, tree_store
+
+INDEX_VERSION = 1
+FORMATS = ['lines', 'ptb', 'conll']
+
+# readline (with universal newlines) ends lines at any of these
+LINE_END = re.compile(rb'\r\n|\r|\n')
+
+def line_offsets(data):
+    '''The offset of the start of each line in data, and the end of the last.'''
+    ans = array('q', [0])
+    ans.extend(match.end() for match in LINE_END.finditer(data))
+    if ans[-1] != len(data):
+        ans.append(len(data))
+    return ans
+
+
+def ptb_offsets(filename):
+    '''The offsets of the trees in a PTB file, as found by
+    treebanks.ptb_tree_spans, including empty trees.  The file is read as
+    Latin-1, so that offsets in the text are byte offsets (and the bytes of
+    brackets, newlines and tabs are the same in UTF-8).'''
+    ans = array('q', [0])
+    with open(filename, encoding='latin-1', newline='') as src:
+        for start, end, text in treebanks.ptb_tree_spans(src):
+            ans.append(end)
+    return ans
+
+
+def conll_offsets(data):
+    '''The offsets of the sentences in a CoNLL file, each a block of lines
+    ending with a blank line.  Like generate_trees, this stops at a block with
+    no lines for words, or an unfinished block at the end of the file.'''
+    ans = array('q', [0])
+    has_words = False
+    lines = line_offsets(data)
+    for i in range(1, len(lines)):
+        line = data[lines[i - 1]:lines[i]].decode('utf-8').strip()
+        if line == '':
+            if not has_words or not line_has_end(data, lines[i]):
+                break
+            ans.append(lines[i])
+            has_words = False
+        elif line[0] != '#':
+            has_words = True
+    return ans
+
+def line_has_end(data, offset):
+    '''Check that a line ending at offset was ended by a newline (rather than
+    the end of the file).'''
+    return offset > 0 and data[offset - 1:offset] in (b'\n', b'\r')
+
+
+def index_filename(filename, file_format):
+    if file_format == 'lines':
+        return filename + '.index'
+    return "{}.{}.index".format(filename, file_format)
+
+
+def file_version(filename):
+    '''What identifies the version of the file an index was built for.'''
+    info = os.stat(filename)
+    return [info.st_size, info.st_mtime_ns]
+
+
+class TreeIndex:
+    '''The sentences of a file, read through a memory map using the offsets in
+    its index, which is built (and saved, if possible) when it is missing or
+    the file has changed.'''
+    def __init__(self, filename, file_format='lines'):
+        if file_format not in FORMATS:
+            raise Exception("Unknown format {}, expected one of {}".format(file_format, ', '.join(FORMATS)))
+        self.filename = filename
+        self.file_format = file_format
+        self.src = open(filename, 'rb')
+        self.data = b''
+        if os.fstat(self.src.fileno()).st_size > 0:
+            self.data = mmap.mmap(self.src.fileno(), 0, access=mmap.ACCESS_READ)
+        self.offsets = self.read_index()
+        if self.offsets is None:
+            self.offsets = self.build_index()
+
+    def header(self):
+        return {
+            'version': INDEX_VERSION,
+            'format': self.file_format,
+            'file': file_version(self.filename),
+            'byteorder': sys.byteorder
+        }
+
+    def read_index(self):
+        '''The offsets saved in the index file, or None if there is no index
+        for this version of the file.'''
+        try:
+            with open(index_filename(self.filename, self.file_format), 'rb') as src:
+                header = json.loads(src.readline().decode('utf-8'))
+                if header != self.header():
+                    return None
+                offsets = array('q')
+                offsets.frombytes(src.read())
+                return offsets
+        except (IOError, ValueError):
+            return None
+
+    def build_index(self):
+        if self.file_format == 'lines':
+            offsets = line_offsets(self.data)
+        elif self.file_format == 'ptb':
+            offsets = ptb_offsets(self.filename)
+        else:
+            offsets = conll_offsets(self.data)
+
+        # Saved under a temporary name and renamed, so a reader never sees part
+        # of an index.  Without write access the index is only kept in memory.
+        name = index_filename(self.filename, self.file_format)
+        try:
+            with open(name + '.tmp', 'wb') as out:
+                out.write(json.dumps(self.header()).encode('utf-8') + b'\n')
+                offsets.tofile(out)
+            os.replace(name + '.tmp', name)
+        except IOError:
+            pass
+        return offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def text(self, number):
+        '''The text of a sentence, as it would be read from the file (for lines,
+        this includes the newline, and is '' after the last line, as readline
+        gives).'''
+        if not 1 <= number < len(self.offsets):
+            if self.file_format == 'lines':
+                return ''
+            raise IndexError("No sentence {} in {}".format(number, self.filename))
+        text = self.data[self.offsets[number - 1]:self.offsets[number]].decode('utf-8')
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        if self.file_format == 'ptb':
+            text = text.translate(treebanks.WHITESPACE_TO_SPACE)
+        return text
+
+    def tree(self, number, allow_empty_labels=False, allow_empty_words=False):
+        '''The tree for a sentence, as generate_trees would give it (with None
+        for empty trees).'''
+        text = self.text(number)
+        if self.file_format == 'conll':
+            return treebanks.conll_read_tree(StringIO(text))
+        if '()' in text or text.strip() == '':
+            return None
+        return treebanks.ptb_tree_from_text(text, allow_empty_labels, allow_empty_words)
+
+    def close(self):
+        if self.data != b'':
+            self.data.close()
+        self.src.close()
+
+
+def selected_lines(filenames, ranges):
+    '''For the sentences in a list of ranges from init.get_sentences, the
+    sentence number and a list of the corresponding line from each file (''
+    beyond the end of a file).  Open ranges run one line past the end of the
+    first file, so that a reader sees the end of the input as it would when
+    reading every line.  Files written by tree_store.write_trees are read
+    with their own index, as if they had one tree per line.'''
+    indexes = []
+    for filename in filenames:
+        if tree_store.is_tree_store(filename):
+            indexes.append(tree_store.TreeStore(filename))
+        else:
+            indexes.append(TreeIndex(filename))
+    try:
+        for number in init.sentence_numbers(ranges, len(indexes[0]) + 1):
+            yield number, [index.text(number) for index in indexes]
+    finally:
+        for index in indexes:
+            index.close()
+
+
+if __name__ == '__main__':
+    print("Running doctest")
+    import doctest
+    doctest.testmod()
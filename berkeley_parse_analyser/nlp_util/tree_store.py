@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 noet:
+
+'''A binary file of trees, so that a corpus can be read and normalised once,
+and then loaded without parsing bracketed text again.  The nodes of all the
+trees are stored as in a FlatTree, in flat arrays, with one table of labels
+and one of words for the whole file.  Reading maps the file into memory, and
+the trees it gives are FlatTrees over slices of the map, so nothing is copied
+until a tree is turned into a PSTree.
+
+Empty trees are stored as None, so trees keep their numbers (counting from
+one, as sentences do elsewhere).  The analysis programs read a store in place
+of a file with one tree per line, with the text of each tree as its line (see
+open_lines).
+
+>>> import os, tempfile
+>>> filename = os.path.join(tempfile.mkdtemp(), 'wsj.trees')
+>>> trees = [pstree.tree_from_text(text) for text in ["(ROOT (S (NP (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti)))))", "(ROOT (NP (NNP Elianti)))"]]
+>>> write_trees(filename, trees[:1] + [None] + trees[1:])
+3
+>>> store = TreeStore(filename)
+>>> len(store), store.tree(2)
+(3, None)
+>>> flat = store.flat(3)
+>>> print(flat.root())
+(ROOT (NP (NNP Elianti)))
+>>> store.tree(1)
+(ROOT (S (NP (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti)))))
+>>> store.label_table
+('ROOT', 'S', 'NP', 'NNP', 'VP', 'VBZ')
+>>> store.close()
+>>> is_tree_store(filename)
+True
+>>> lines = open_lines(filename)
+>>> [lines.readline() for number in range(4)]
+['(ROOT (S (NP (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti)))))\\n', '()\\n', '(ROOT (NP (NNP Elianti)))\\n', '']
+>>> lines.close()
+'''
+
+from array import array
+import json
+import mmap
+import sys
+
+from . import pstree, flat_tree, labels, render_tree
+
+FORMAT = 'berkeley-parse-analyser trees'
+VERSION = 1
+
+# The arrays in a file, and the types they are built with (each is stored
+# with the smallest type that holds its values).  tree_starts has the index of
+# the first node of each tree, and then the number of nodes.  The nodes of each
+# tree are stored as in a FlatTree (parents are indices within the tree),
+# except that label and word ids are for the tables of the whole file.  Each
+# table is stored as the UTF-8 text of its entries joined together, with the
+# offset of the start of each entry and of the end of the last.
+SECTIONS = [
+    ('tree_starts', 'q'),
+    ('labels', 'i'),
+    ('starts', 'i'),
+    ('ends', 'i'),
+    ('parents', 'i'),
+    ('sizes', 'i'),
+    ('word_ids', 'i'),
+    ('label_offsets', 'q'),
+    ('label_text', 'B'),
+    ('word_offsets', 'q'),
+    ('word_text', 'B'),
+]
+
+# Sections start at multiples of this, so that their values are aligned
+ALIGNMENT = 8
+
+# The most of a file read to find its header
+MAX_HEADER = 4096
+
+def smallest_typecode(values):
+    '''The smallest signed integer type that holds all of the values.
+
+    >>> [smallest_typecode(values) for values in [[], [-1, 127], [128], [1 << 40]]]
+    ['b', 'b', 'h', 'q']
+    '''
+    low = min(values, default=0)
+    high = max(values, default=0)
+    for typecode in 'bhi':
+        limit = 1 << (8 * array(typecode).itemsize - 1)
+        if -limit <= low and high < limit:
+            return typecode
+    return 'q'
+
+def string_table(strings):
+    '''The offsets and UTF-8 text for a table of strings.'''
+    offsets = array('q', [0])
+    text = bytearray()
+    for string in strings:
+        text += string.encode('utf-8')
+        offsets.append(len(text))
+    return offsets, array('B', text)
+
+
+def write_trees(filename, trees):
+    '''Store a sequence of trees (PSTrees, or anything with the same interface,
+    and None for empty trees) in filename, returning the number of trees.'''
+    arrays = dict((name, array(typecode)) for name, typecode in SECTIONS)
+    arrays['tree_starts'].append(0)
+    label_ids = {}
+    word_ids = {}
+    for tree in trees:
+        if tree is not None:
+            flat = flat_tree.FlatTree.from_pstree(tree)
+            label_map = [label_ids.setdefault(label, len(label_ids)) for label in flat.label_table]
+            word_map = [word_ids.setdefault(word, len(word_ids)) for word in flat.words]
+            arrays['labels'].extend(label_map[label] for label in flat.labels)
+            for name in ['starts', 'ends', 'parents', 'sizes']:
+                arrays[name].extend(getattr(flat, name))
+            arrays['word_ids'].extend(-1 if word < 0 else word_map[word] for word in flat.word_ids)
+        arrays['tree_starts'].append(len(arrays['labels']))
+    arrays['label_offsets'], arrays['label_text'] = string_table(label_ids)
+    arrays['word_offsets'], arrays['word_text'] = string_table(word_ids)
+
+    for name, typecode in SECTIONS:
+        if typecode != 'B':
+            arrays[name] = array(smallest_typecode(arrays[name]), arrays[name])
+
+    # A header line describing where each array is, padded so that the
+    # arrays that follow it are aligned
+    sections = {}
+    offset = 0
+    for name, typecode in SECTIONS:
+        sections[name] = [offset, len(arrays[name]), arrays[name].typecode]
+        offset += len(arrays[name]) * arrays[name].itemsize
+        offset += -offset % ALIGNMENT
+    header = json.dumps({
+        'format': FORMAT,
+        'version': VERSION,
+        'byteorder': sys.byteorder,
+        'sections': sections
+    }).encode('utf-8')
+    header += b' ' * (-(len(header) + 1) % ALIGNMENT) + b'\n'
+    with open(filename, 'wb') as out:
+        out.write(header)
+        for name, typecode in SECTIONS:
+            arrays[name].tofile(out)
+            out.write(b'\0' * (-out.tell() % ALIGNMENT))
+    return len(arrays['tree_starts']) - 1
+
+
+class StringTable:
+    '''Entries in a table stored by string_table, decoded (and interned, so
+    that trees share them) when they are first used.'''
+    def __init__(self, offsets, text):
+        self.offsets = offsets
+        self.text = text
+        self.decoded = [None] * len(self)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        ans = self.decoded[index]
+        if ans is None:
+            ans = sys.intern(str(self.text[self.offsets[index]:self.offsets[index + 1]], 'utf-8'))
+            self.decoded[index] = ans
+        return ans
+
+
+class TreeStore:
+    '''The trees in a file written by write_trees.'''
+    def __init__(self, filename):
+        self.filename = filename
+        self.src = open(filename, 'rb')
+        try:
+            header = json.loads(self.src.readline().decode('utf-8'))
+        except ValueError:
+            header = {}
+        if header.get('format') != FORMAT or header.get('version') != VERSION:
+            raise Exception("{} is not a file of trees written by write_trees (version {})".format(filename, VERSION))
+        if header['byteorder'] != sys.byteorder:
+            raise Exception("{} was written on a machine with {} endian byte order".format(filename, header['byteorder']))
+
+        # Empty arrays take no space, so a file may end right after its header
+        base = self.src.tell()
+        self.data = None
+        view = memoryview(b'')
+        if self.src.seek(0, 2) > base:
+            self.data = mmap.mmap(self.src.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(self.data)
+        self.sections = {}
+        for name, typecode in SECTIONS:
+            offset, length, typecode = header['sections'][name]
+            start = base + offset
+            end = start + length * array(typecode).itemsize
+            self.sections[name] = view[start:end].cast(typecode)
+
+        self.tree_starts = self.sections['tree_starts']
+        self.label_table = tuple(labels.intern(label) for label in StringTable(self.sections['label_offsets'], self.sections['label_text']))
+        self.words = StringTable(self.sections['word_offsets'], self.sections['word_text'])
+
+    def __len__(self):
+        return len(self.tree_starts) - 1
+
+    def flat(self, number):
+        '''A tree as a FlatTree, over the arrays in the file, or None if the
+        tree is empty.'''
+        if not 1 <= number <= len(self):
+            raise IndexError("No tree {} in {}".format(number, self.filename))
+        start = self.tree_starts[number - 1]
+        end = self.tree_starts[number]
+        if start == end:
+            return None
+        ans = flat_tree.FlatTree()
+        ans.label_table = self.label_table
+        ans.words = self.words
+        for name in ['labels', 'starts', 'ends', 'parents', 'sizes', 'word_ids']:
+            setattr(ans, name, self.sections[name][start:end])
+        return ans
+
+    def tree(self, number):
+        '''A tree as a PSTree, or None if the tree is empty.'''
+        flat = self.flat(number)
+        if flat is None:
+            return None
+        return flat.to_pstree()
+
+    def text(self, number):
+        '''A tree as the line of text it would be in a file with one tree per
+        line: with () for an empty tree, and '' after the last tree, as
+        readline gives.'''
+        if number > len(self):
+            return ''
+        flat = self.flat(number)
+        if flat is None:
+            return '()\n'
+        return render_tree.text_tree(flat.root(), single_line=True) + '\n'
+
+    def close(self):
+        '''Close the file.  Trees from flat use the memory map, so if any are
+        still in use the map is left to be closed once they are gone.'''
+        self.sections = {}
+        self.tree_starts = array('q', [0])
+        self.words = None
+        if self.data is not None:
+            try:
+                self.data.close()
+            except BufferError:
+                pass
+        self.src.close()
+
+
+class LineReader:
+    '''The trees in a file written by write_trees, read one at a time with
+    readline, as lines from TreeStore.text.'''
+    def __init__(self, filename):
+        self.store = TreeStore(filename)
+        self.number = 0
+
+    def readline(self):
+        self.number += 1
+        return self.store.text(self.number)
+
+    def close(self):
+        self.store.close()
+
+
+def is_tree_store(filename):
+    '''Check whether a file was written by write_trees, from its header.'''
+    try:
+        with open(filename, 'rb') as src:
+            header = json.loads(src.readline(MAX_HEADER).decode('utf-8'))
+    except (IOError, ValueError):
+        return False
+    return isinstance(header, dict) and header.get('format') == FORMAT
+
+def open_lines(filename):
+    '''Open a file with one tree per line, or a file written by write_trees to
+    be read as if it were one.'''
+    if is_tree_store(filename):
+        return LineReader(filename)
+    return open(filename)
+
+def count_lines(filename):
+    '''The number of lines in a file with one tree per line, or of trees in a
+    file written by write_trees.'''
+    if is_tree_store(filename):
+        store = TreeStore(filename)
+        count = len(store)
+        store.close()
+        return count
+    with open(filename) as src:
+        return sum(1 for line in src)
+
+
+def read_trees(filename):
+    '''Generate the trees in a file written by write_trees, as PSTrees (and
+    None for empty trees), like treebanks.generate_trees.'''
+    store = TreeStore(filename)
+    try:
+        for number in range(1, len(store) + 1):
+            yield store.tree(number)
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    print("Running doctest")
+    import doctest
+    doctest.testmod()
@@ -2,37 +2,214 @@
 # -*- coding: utf-8 -*-
 # vim: set ts=2 sw=2 noet:
 
-from .pstree import clone_and_find, PSTree
+'''Operations that modify trees.  Each operation can record what it did by
+passing in an edits list, which can then be reverted with undo.  A SpanIndex
+of the tree can also be passed in, and is kept up to date, e.g.:
 
-def change_label_by_node(node, new_label, in_place):
+>>> tree = tree_from_text("(ROOT (S (NP (PRP I)) (VP (VBD ran) (NP (NN home)))))")
+>>> edits = []
+>>> success, response = add_node(tree, (1, 3), 'X', edits=edits)
+>>> success, response = change_label(tree, 'Y', (1, 3), 'X', edits=edits)
+>>> print(tree)
+(ROOT (S (NP (PRP I)) (Y (VP (VBD ran) (NP (NN home))))))
+>>> [(edit.removed, edit.added) for edit in edits]
+[([], [(1, 3, 'X')]), ([(1, 3, 'X')], [(1, 3, 'Y')])]
+>>> undo(edits)
+>>> print(tree)
+(ROOT (S (NP (PRP I)) (VP (VBD ran) (NP (NN home)))))
+>>> vp = tree.subtrees[0].subtrees[1]
+>>> success, response = move_nodes(vp.subtrees[1:], tree.subtrees[0], edits=edits)
+>>> print(tree)
+(ROOT (S (NP (PRP I)) (VP (VBD ran)) (NP (NN home))))
+>>> edits[0].removed, edits[0].added
+([(1, 3, 'VP')], [(1, 2, 'VP')])
+>>> undo(edits)
+>>> print(tree, tree.check_consistency())
+(ROOT (S (NP (PRP I)) (VP (VBD ran) (NP (NN home))))) True
+>>> index = SpanIndex(tree)
+>>> success, response = add_node(tree, (1, 3), 'X', edits=edits, index=index)
+>>> success, response = remove_node(tree, (1, 3), 'VP', edits=edits, index=index)
+>>> index.nodes((1, 3))
+[(X (VBD ran) (NP (NN home)))]
+>>> undo(edits, index)
+>>> index.find((1, 3), 'VP')
+[(VP (VBD ran) (NP (NN home)))]
+'''
+
+from .pstree import clone_and_find, PSTree, SpanIndex, tree_from_text
+
+class LabelChange:
+    '''Record of a node being given a new label.'''
+    def __init__(self, node, new_label):
+        self.node = node
+        self.old_label = node.label
+        self.removed = []
+        self.added = []
+        if not node.is_terminal():
+            self.removed.append((node.span[0], node.span[1], node.label))
+            self.added.append((node.span[0], node.span[1], new_label))
+
+    def undo(self):
+        self.node.label = self.old_label
+
+    def changed_nodes(self):
+        return [self.node]
+
+class NodeAddition:
+    '''Record of a node being inserted above a sequence of siblings.'''
+    def __init__(self, node, parent, position):
+        self.node = node
+        self.parent = parent
+        self.position = position
+        self.removed = []
+        self.added = [(node.span[0], node.span[1], node.label)]
+
+    def undo(self):
+        self.parent.subtrees[self.position:self.position + 1] = self.node.subtrees
+        for subtree in self.node.subtrees:
+            subtree.parent = self.parent
+
+    def changed_nodes(self):
+        return [self.node]
+
+class NodeRemoval:
+    '''Record of a node being removed, with its subtrees taking its place.'''
+    def __init__(self, node, parent, position):
+        self.node = node
+        self.parent = parent
+        self.position = position
+        self.removed = []
+        self.added = []
+        if not node.is_terminal():
+            self.removed.append((node.span[0], node.span[1], node.label))
+
+    def undo(self):
+        end = self.position + len(self.node.subtrees)
+        self.parent.subtrees[self.position:end] = [self.node]
+        for subtree in self.node.subtrees:
+            subtree.parent = self.node
+
+    def changed_nodes(self):
+        return [self.node]
+
+class NodeMove:
+    '''Record of a sequence of siblings being moved to a new parent, including
+    any trivial unary that was collapsed and the spans that changed as a
+    result.'''
+    def __init__(self, nodes, old_parent, position, new_parent):
+        self.nodes = nodes
+        self.old_parent = old_parent
+        self.position = position
+        self.new_parent = new_parent
+        self.collapsed = None
+        self.collapsed_into = None
+        self.collapsed_subtrees = None
+        self.spans = []
+        self.removed = []
+        self.added = []
+
+    def note_brackets(self):
+        '''Set the brackets removed and added, once the move is complete.'''
+        for node, span in self.spans:
+            if not node.is_terminal():
+                self.removed.append((span[0], span[1], node.label))
+                if node != self.collapsed:
+                    self.added.append((node.span[0], node.span[1], node.label))
+        collapsed = self.collapsed
+        if collapsed is not None and collapsed not in [node for node, span in self.spans]:
+            self.removed.append((collapsed.span[0], collapsed.span[1], collapsed.label))
+
+    def undo(self):
+        for node, span in self.spans[::-1]:
+            node.span = span
+        if self.collapsed is not None:
+            self.collapsed_into.subtrees = self.collapsed_subtrees
+            for subtree in self.collapsed.subtrees:
+                subtree.parent = self.collapsed
+        for node in self.nodes:
+            node.parent.subtrees.remove(node)
+        self.old_parent.subtrees[self.position:self.position] = self.nodes
+        for node in self.nodes:
+            node.parent = self.old_parent
+
+    def changed_nodes(self):
+        ans = [node for node, span in self.spans] + self.nodes
+        if self.collapsed is not None:
+            ans.append(self.collapsed)
+        return ans
+
+def undo(edits, index=None):
+    '''Revert a list of edits, most recent first, emptying the list.'''
+    while len(edits) > 0:
+        edit = edits.pop()
+        edit.undo()
+        if index is not None:
+            index.update(edit)
+
+def record(edit, edits, index):
+    '''Note an edit in the list of edits and the index, if they are given.'''
+    if edits is not None:
+        edits.append(edit)
+    if index is not None:
+        index.update(edit)
+
+def update_spans(node, changed):
+    '''Recalculate spans from node up to the root, based on the spans of
+    subtrees, noting the original span of each node that changes (nodes already
+    in changed keep their first entry).'''
+    while node is not None:
+        span = (node.subtrees[0].span[0], node.subtrees[-1].span[1])
+        if span != node.span:
+            if node not in [prev for prev, prev_span in changed]:
+                changed.append((node, node.span))
+            node.span = span
+        node = node.parent
+
+
+# The index, if given, is for the tree passed in, so it is used to find nodes
+# in either case, but only updated for changes made in place.
+
+def change_label_by_node(node, new_label, in_place, edits=None, index=None):
     if not in_place:
         node = clone_and_find(node)
+        index = None
+    edit = None
+    if edits is not None or index is not None:
+        edit = LabelChange(node, new_label)
     node.label = new_label
+    if edit is not None:
+        record(edit, edits, index)
     return (True, (node.root(), node))
 
-def change_label_by_span(tree, new_label, span, cur_label, in_place=True):
+def change_label_by_span(tree, new_label, span, cur_label, in_place=True, edits=None, index=None):
+    if index is not None:
+        nodes = index.find(span, cur_label)
+        if len(nodes) > 0:
+            return change_label_by_node(nodes[0], new_label, in_place, edits, index)
+        return (False, "Failed to find node with ({}, {} - {})".format(cur_label, *span))
     tree = tree.root()
     for node in tree:
         if node.span == span and node.label == cur_label:
-            return change_label_by_node(node, new_label, in_place)
+            return change_label_by_node(node, new_label, in_place, edits)
     return (False, "Failed to find node with ({}, {} - {})".format(cur_label, *span))
 
-def change_label(tree, new_label, span=None, cur_label=None, in_place=True):
+def change_label(tree, new_label, span=None, cur_label=None, in_place=True, edits=None, index=None):
     if span is None and cur_label is None:
-        return change_label_by_node(tree, new_label, in_place)
+        return change_label_by_node(tree, new_label, in_place, edits, index)
     elif span is not None and cur_label is not None:
-        return change_label_by_span(tree, new_label, span, cur_label, in_place)
+        return change_label_by_span(tree, new_label, span, cur_label, in_place, edits, index)
     else:
         raise Exception("Invalid combination of arguments for change label request")
 
 
-def add_node(tree, span, label, position=0, in_place=True):
+def add_node(tree, span, label, position=0, in_place=True, edits=None, index=None):
     '''Introduce a new node in the tree.  Position indicates what to do when a
     node already exists with the same span.  Zero indicates above any current
     nodes, one indicates beneath the first, and so on.'''
     tree = tree.root()
     if not in_place:
         tree = tree.clone()
+        index = None
 
     # Find the node(s) that should be within the new span
     nodes = tree.get_spanning_nodes(*span)
@@ -64,12 +241,15 @@ def add_node(tree, span, label, position=0, in_place=True):
         nnode.subtrees.append(node)
         node.parent = nnode
 
+    if edits is not None or index is not None:
+        record(NodeAddition(nnode, parent, position), edits, index)
     return (True, (tree, nnode))
 
 
-def remove_node_by_node(node, in_place):
+def remove_node_by_node(node, in_place, edits=None, index=None):
     if not in_place:
         node = clone_and_find(node)
+        index = None
     parent = node.parent
     position = parent.subtrees.index(node)
     init_position = position
@@ -78,34 +258,40 @@ def remove_node_by_node(node, in_place):
         subtree.parent = parent
         parent.subtrees.insert(position, subtree)
         position += 1
+    if edits is not None or index is not None:
+        record(NodeRemoval(node, parent, init_position), edits, index)
     return (True, (parent, node, init_position, position))
 
-def remove_node_by_span(tree, span, label, position, in_place):
+def remove_node_by_span(tree, span, label, position, in_place, edits=None, index=None):
     '''Delete a node from the tree.  Position indicates what to do when multiple
     nodes of the requested type exist.  Zero indicates to remove the top node,
     one indicates to remove the second, and so on.'''
-    nodes = tree.get_nodes('all', span[0], span[1])
-    nodes = [node for node in nodes if node.label == label]
+    if index is not None:
+        nodes = index.find(span, label)
+    else:
+        nodes = tree.get_nodes('all', span[0], span[1])
+        nodes = [node for node in nodes if node.label == label]
     if len(nodes) <= position:
         return (False, "No node matching {} ({}, {} - {}) found".format(position, label, *span))
-    return remove_node_by_node(nodes[position], in_place)
+    return remove_node_by_node(nodes[position], in_place, edits, index)
 
-def remove_node(tree, span=None, label=None, position=None, in_place=True):
+def remove_node(tree, span=None, label=None, position=None, in_place=True, edits=None, index=None):
     if span is None and label is None:
-        return remove_node_by_node(tree, in_place)
+        return remove_node_by_node(tree, in_place, edits, index)
     elif span is not None and label is not None:
         if position is None:
             position = 0
-        return remove_node_by_span(tree, span, label, position, in_place)
+        return remove_node_by_span(tree, span, label, position, in_place, edits, index)
     else:
         raise Exception("Invalid combination of arguments for remove node request")
 
 
-def move_nodes(nodes, new_parent, in_place=True, remove_empty=True, remove_trivial_unary=True):
+def move_nodes(nodes, new_parent, in_place=True, remove_empty=True, remove_trivial_unary=True, edits=None, index=None):
     if not in_place:
         nodes = clone_and_find(nodes + [new_parent])
         new_parent = nodes[-1]
         nodes = nodes[:-1]
+        index = None
 
     # Find the insertion point in the new parent's subtrees
     old_parent = nodes[0].parent
@@ -129,6 +315,7 @@ def move_nodes(nodes, new_parent, in_place=True, remove_empty=True, remove_trivi
             return (False, "new_parent did not have suitable insertion point")
 
     # Move the nodes across
+    edit = NodeMove(nodes, old_parent, old_parent.subtrees.index(nodes[0]), new_parent)
     for node in nodes:
         node.parent.subtrees.remove(node)
         new_parent.subtrees.insert(insertion_point, node)
@@ -151,10 +338,26 @@ def move_nodes(nodes, new_parent, in_place=True, remove_empty=True, remove_trivi
     if remove_trivial_unary:
         to_check = to_check_for_unary
         if len(to_check.subtrees) == 1 and to_check.label == to_check.subtrees[0].label:
-            to_check.subtrees = to_check.subtrees[0].subtrees
-            for subtree in to_check.subtrees:
-                subtree.parent = to_check
+            if not to_check.subtrees[0].is_terminal():
+                edit.collapsed = to_check.subtrees[0]
+                edit.collapsed_into = to_check
+                edit.collapsed_subtrees = to_check.subtrees
+                to_check.subtrees = to_check.subtrees[0].subtrees
+                for subtree in to_check.subtrees:
+                    subtree.parent = to_check
 
-    new_parent.root().calculate_spans()
+    # Update spans on both sides of the move (if the new parent was collapsed
+    # its span is left as it was).
+    update_spans(to_check_for_unary, edit.spans)
+    if new_parent != edit.collapsed:
+        update_spans(new_parent, edit.spans)
+    edit.note_brackets()
+    record(edit, edits, index)
 
     return (True, (new_parent.root(), nodes, new_parent))
+
+
+if __name__ == '__main__':
+    print("Running doctest")
+    import doctest
+    doctest.testmod()
@@ -2,7 +2,10 @@
 # -*- coding: utf-8 -*-
 # vim: set ts=2 sw=2 noet:
 
+from itertools import accumulate, repeat
+
 from .pstree import *
+from .labels import label_info, split_label_type_and_function
 
 ptb_tag_set = set(['S', 'SBAR', 'SBARQ', 'SINV', 'SQ', 'ADJP', 'ADVP', 'CONJP',
 'FRAG', 'INTJ', 'LST', 'NAC', 'NP', 'NX', 'PP', 'PRN', 'PRT', 'QP', 'RRC',
@@ -31,13 +34,14 @@ def ptb_cleaning(tree, in_place=True):
     '''Clean up some bugs/odd things in the PTB, and standardise punctuation.'''
     if not in_place:
         tree = tree.clone()
-    for node in tree:
+    # Nodes are independent here, so they are visited in any order, with a
+    # stack (which is quicker than the tree's iterator)
+    stack = [tree]
+    while stack:
+        node = stack.pop()
+        stack.extend(node.subtrees)
         # In a small number of cases multiple POS tags were assigned
-        if '|' in node.label:
-            if 'ADVP' in node.label:
-                node.label = 'ADVP'
-            else:
-                node.label = node.label.split('|')[0]
+        node.label = label_info(node.label).cleaned
         # Fix some issues with variation in output, and one error in the treebank
         # for a word with a punctuation POS
         if node.word in word_to_word_mapping:
@@ -61,45 +65,74 @@ def remove_trivial_unaries(tree, in_place=True):
     (ROOT (S (PP (IN By) (NP (CD 1997)))))
     '''
     if in_place:
-        if len(tree.subtrees) == 1 and tree.label == tree.subtrees[0].label:
-            tree.subtrees = tree.subtrees[0].subtrees
-            for subtree in tree.subtrees:
-                subtree.parent = tree
-            remove_trivial_unaries(tree, True)
-        else:
-            for subtree in tree.subtrees:
-                remove_trivial_unaries(subtree, True)
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            while len(node.subtrees) == 1 and node.label == node.subtrees[0].label:
+                node.subtrees = node.subtrees[0].subtrees
+                for subtree in node.subtrees:
+                    subtree.parent = node
+            stack.extend(node.subtrees)
     else:
-        if len(tree.subtrees) == 1 and tree.label == tree.subtrees[0].label:
-            return remove_trivial_unaries(tree.subtrees[0], False)
-        subtrees = [remove_trivial_unaries(subtree, False) for subtree in tree.subtrees]
-        tree = PSTree(tree.word, tree.label, tree.span, None, subtrees)
-        for subtree in subtrees:
-            subtree.parent = tree
+        # Copies are made of the lowest node in each A-over-A chain
+        tree = lowest_of_unary_chain(tree)
+        ans = PSTree(tree.word, tree.label, tree.span)
+        stack = [(tree, ans)]
+        while stack:
+            node, copy = stack.pop()
+            for subtree in node.subtrees:
+                subtree = lowest_of_unary_chain(subtree)
+                subcopy = PSTree(subtree.word, subtree.label, subtree.span, copy)
+                copy.subtrees.append(subcopy)
+                stack.append((subtree, subcopy))
+        tree = ans
+    return tree
+
+def lowest_of_unary_chain(tree):
+    while len(tree.subtrees) == 1 and tree.label == tree.subtrees[0].label:
+        tree = tree.subtrees[0]
     return tree
 
 def remove_nodes(tree, filter_func, in_place=True, preserve_subtrees=False, init_call=True):
-    if filter_func(tree) and not preserve_subtrees:
-        return None
-    subtrees = []
-    for subtree in tree.subtrees:
-        ans = remove_nodes(subtree, filter_func, in_place, preserve_subtrees, False)
+    '''Remove the nodes that filter_func is true for, and any non-terminals
+    left with no subtrees.  With preserve_subtrees the subtrees of removed
+    nodes are kept, in their place, and the result for a removed root is the
+    list of them.'''
+    # Each node that is kept contributes itself, or the list of its subtrees,
+    # to the subtrees of its parent once its own subtrees are done
+    ans = None
+    parts = [[]]
+    stack = [(tree, None)]
+    while stack:
+        node, removed = stack.pop()
+        if removed is None:
+            removed = filter_func(node)
+            if removed and not preserve_subtrees:
+                continue
+            parts.append([])
+            stack.append((node, removed))
+            for subtree in reversed(node.subtrees):
+                stack.append((subtree, None))
+            continue
+
+        subtrees = parts.pop()
+        if len(subtrees) == 0 and (not node.is_terminal()):
+            ans = None
+        elif removed:
+            ans = subtrees
+        elif in_place:
+            node.subtrees = subtrees
+            for subtree in subtrees:
+                subtree.parent = node
+            ans = node
+        else:
+            ans = PSTree(node.word, node.label, node.span, None, subtrees)
         if ans is not None:
             if type(ans) == type([]):
-                subtrees += ans
+                parts[-1] += ans
             else:
-                subtrees.append(ans)
-    if len(subtrees) == 0 and (not tree.is_terminal()):
-        return None
-    if filter_func(tree) and preserve_subtrees:
-        return subtrees
-    if in_place:
-        tree.subtrees = subtrees
-        for subtree in subtrees:
-            subtree.parent = tree
-    else:
-        tree = PSTree(tree.word, tree.label, tree.span, None, subtrees)
-    return tree
+                parts[-1].append(ans)
+    return ans
 
 def remove_traces(tree, in_place=True):
     '''Adjust the tree to remove traces.
@@ -110,15 +143,6 @@ def remove_traces(tree, in_place=True):
     '''
     return remove_nodes(tree, PSTree.is_trace, in_place)
 
-def split_label_type_and_function(label):
-    parts = label.split('=')
-    if len(label) > 0 and label[0] != '-':
-        cur = parts
-        parts = []
-        for part in cur:
-            parts += part.split('-')
-    return parts
-
 def remove_function_tags(tree, in_place=True):
     '''Adjust the tree to remove function tags on labels.
 
@@ -131,18 +155,16 @@ def remove_function_tags(tree, in_place=True):
     >>> remove_function_tags(tree)
     (ROOT (S (NP (`` ``) (NP (NNP Funny) (NNP Business)) ('' '') (PRN (-LRB- -LRB-) (NP (NNP Soho)) (, ,) (NP (CD 228) (NNS pages)) (, ,) (NP ($ $) (CD 17.95)) (-RRB- -RRB-)) (PP (IN by) (NP (NNP Gary) (NNP Katzenstein)))) (VP (VBZ is) (NP (NP (NN anything)) (PP (RB but)))) (. .)))
     '''
-    label = split_label_type_and_function(tree.label)[0]
-    if in_place:
-        for subtree in tree.subtrees:
-            remove_function_tags(subtree, True)
-        tree.label = label
-    else:
-        subtrees = [remove_function_tags(subtree, False) for subtree in tree.subtrees]
-        tree = PSTree(tree.word, label, tree.span, None, subtrees)
-        for subtree in subtrees:
-            subtree.parent = tree
+    if not in_place:
+        tree = tree.clone()
+    for node in tree:
+        node.label = label_info(node.label).base
     return tree
 
+def is_evalb_ignored(tree):
+    info = label_info(tree.label)
+    return info.is_trace or info.is_punctuation
+
 # Applies rules to strip out the parts of the tree that are not used in the
 # standard evalb evaluation
 def apply_collins_rules(tree, in_place=True):
@@ -177,8 +199,7 @@ def apply_collins_rules(tree, in_place=True):
     ptb_cleaning(tree, True)
 
     # Remove Puncturation
-    labels_to_ignore = ["-NONE-", ",", ":", "``", "''", "."]
-    remove_nodes(tree, lambda t: t.label in labels_to_ignore, True)
+    remove_nodes(tree, is_evalb_ignored, True)
 
     # Set all PRTs to be ADVPs
     POS_to_convert = {'PRT': 'ADVP'}
@@ -205,13 +226,13 @@ def homogenise_tree(tree, tag_set=ptb_tag_set):
     orig = tree
     tree = tree.root()
     if tree.label != 'ROOT':
-        while split_label_type_and_function(tree.label)[0] not in tag_set:
+        while label_info(tree.label).base not in tag_set:
             if len(tree.subtrees) > 1:
                 break
             elif tree.is_terminal():
                 raise Exception("Tree has no labels in the tag set\n%s" % orig.__repr__())
             tree = tree.subtrees[0]
-        if split_label_type_and_function(tree.label)[0] not in tag_set:
+        if label_info(tree.label).base not in tag_set:
             tree.label = 'ROOT'
         else:
             root = PSTree(None, 'ROOT', tree.span, None, [])
@@ -238,34 +259,127 @@ def ptb_read_tree(source, return_empty=False, allow_empty_labels=False, allow_em
     >>> in_file = StringIO(file_text)
     >>> ptb_read_tree(in_file)
     (ROOT (S (NP-SBJ (NNP Scotty)) (VP (VBD did) (RB not) (VP (VB go) (ADVP (RB back)) (PP (TO to) (NP (NN school))))) (. .)))'''
-    cur_text = ''
+    # Whether the text has a '(', or a '()', are tracked as it is read,
+    # rather than searched for each time the depth is zero
+    cur_text = []
     depth = 0
+    has_open = False
+    has_empty = False
+    prev = ''
     while True:
         char = source.read(1)
         if char == '':
             return None
-        if char == '\n' and cur_text == ' ' and blank_line_coverage:
+        if char == '\n' and blank_line_coverage and len(cur_text) == 1 and cur_text[0] == ' ':
             return "Empty"
         if char in '\n\t':
             char = ' '
-        cur_text += char
+        cur_text.append(char)
         if char == '(':
             depth += 1
+            has_open = True
         elif char == ')':
             depth -= 1
+            if prev == '(':
+                has_empty = True
+        prev = char
         if depth == 0:
-            if '()' in cur_text:
+            if has_empty:
                 if return_empty:
                     return "Empty"
-                cur_text = ''
+                cur_text = []
+                has_open = False
+                has_empty = False
+                prev = ''
                 continue
-            if '(' in cur_text:
+            if has_open:
                 break
 
-    tree = tree_from_text(cur_text, allow_empty_labels, allow_empty_words)
+    return ptb_tree_from_text(''.join(cur_text), allow_empty_labels, allow_empty_words)
+
+def ptb_tree_from_text(text, allow_empty_labels=False, allow_empty_words=False):
+    '''Construct a tree from the text of one tree in a PTB file.'''
+    tree = tree_from_text(text, allow_empty_labels, allow_empty_words)
     ptb_cleaning(tree)
     return tree
 
+PTB_BLOCK_SIZE = 1 << 20
+BRACKET_DEPTH = {'(': 1, ')': -1}
+WHITESPACE_TO_SPACE = str.maketrans('\n\t', '  ')
+
+def ptb_tree_spans(source, block_size=PTB_BLOCK_SIZE):
+    '''Find the trees in a PTB file, as ptb_read_tree would read them, giving
+    the start and end of each (as offsets in the text of the file) and its
+    text, with newlines and tabs as spaces.  Empty trees (containing "()")
+    are included.  The file is read in large blocks, so it is left at the end
+    of the block containing the end of the last tree given, rather than just
+    after that tree.
+
+    The end of a tree is the first point after its first open bracket where
+    the bracket depth is zero.  Blocks are split into lines, and a line inside
+    a tree with fewer close brackets than the depth cannot contain the end, so
+    its brackets are only counted.  For other lines the depth after every
+    character is worked out in one pass.
+
+    >>> from io import StringIO
+    >>> list(ptb_tree_spans(StringIO("(A\\n (B b)) (C c)\\n() (D d"), block_size=4))
+    [(0, 10, '(A  (B b))'), (10, 16, ' (C c)'), (16, 19, ' ()')]
+    '''
+    pieces = []
+    depth = 0
+    has_open = False
+    tree_start = 0
+    offset = 0
+    for block in iter(lambda: source.read(block_size), ''):
+        for line in block.splitlines(True):
+            if has_open:
+                closes = line.count(')')
+                if closes < depth:
+                    depth += line.count('(') - closes
+                    pieces.append(line)
+                    offset += len(line)
+                    continue
+
+            # depths[i] is the depth before character i of the line
+            depths = list(accumulate(map(BRACKET_DEPTH.get, line, repeat(0)), initial=depth))
+            start = 0
+            pos = 0
+            while True:
+                if not has_open:
+                    pos = line.find('(', pos)
+                    if pos < 0:
+                        break
+                    has_open = True
+                try:
+                    end = depths.index(0, pos + 1)
+                except ValueError:
+                    break
+                pieces.append(line[start:end])
+                yield tree_start, offset + end, ''.join(pieces).translate(WHITESPACE_TO_SPACE)
+                pieces = []
+                tree_start = offset + end
+                start = end
+                pos = end
+                has_open = False
+            pieces.append(line[start:])
+            depth = depths[-1]
+            offset += len(line)
+
+def ptb_tree_texts(source, return_empty=False, block_size=PTB_BLOCK_SIZE):
+    '''The texts of the trees in a PTB file (see ptb_tree_spans), with "Empty"
+    for empty trees if return_empty is set, and otherwise skipping them.
+
+    >>> from io import StringIO
+    >>> list(ptb_tree_texts(StringIO("(A\\n (B b)) (C c)\\n() (D d"), True, block_size=4))
+    ['(A  (B b))', ' (C c)', 'Empty']
+    '''
+    for start, end, text in ptb_tree_spans(source, block_size):
+        if '()' in text:
+            if return_empty:
+                yield "Empty"
+        else:
+            yield text
+
 def conll_read_tree(source, return_empty=False, allow_empty_labels=False, allow_empty_words=False, blank_line_coverage=False):
     '''Read a single tree from the given CoNLL Shared Task OntoNotes data file.
 
@@ -343,18 +457,28 @@ def generate_trees(source, tree_reader=ptb_read_tree, max_sents=-1, return_empty
     if type(source) == type(''):
         source = open(source)
     count = 0
-    while True:
-        tree = tree_reader(source, return_empty, allow_empty_labels, allow_empty_words)
+    if tree_reader == ptb_read_tree:
+        trees = generate_ptb_trees(source, return_empty, allow_empty_labels, allow_empty_words)
+    else:
+        trees = iter(lambda: tree_reader(source, return_empty, allow_empty_labels, allow_empty_words), None)
+    for tree in trees:
         if tree == "Empty":
             yield None
             continue
-        if tree is None:
-            return
         yield tree
         count += 1
         if count >= max_sents > 0:
             return
 
+def generate_ptb_trees(source, return_empty=False, allow_empty_labels=False, allow_empty_words=False):
+    '''The trees ptb_read_tree would give when called repeatedly, but reading
+    the file in blocks (see ptb_tree_texts).'''
+    for text in ptb_tree_texts(source, return_empty):
+        if text == "Empty":
+            yield text
+        else:
+            yield ptb_tree_from_text(text, allow_empty_labels, allow_empty_words)
+
 def read_trees(source, tree_reader=ptb_read_tree, max_sents=-1, return_empty=False):
     return [tree for tree in generate_trees(source, tree_reader, max_sents, return_empty)]
 
@@ -2,9 +2,10 @@
 # -*- coding: utf-8 -*-
 # vim: set ts=2 sw=2 noet:
 
+import itertools
 import sys
 
-from .nlp_util import pstree, render_tree, nlp_eval, treebanks, parse_errors
+from .nlp_util import pstree, render_tree, nlp_eval, treebanks, parse_errors, init, result_cache, tree_index, tree_store
 
 def mprint(text, out_dict, out_name):
     all_stdout = True
@@ -22,9 +23,10 @@ def mprint(text, out_dict, out_name):
 
 
 if __name__ == '__main__':
-    if len(sys.argv) != 4:
+    args, options = init.get_options(sys.argv, {'shard': None, 'sentences': None})
+    if len(args) != 4:
         print("Print trees with colours to indicate errors (red for extra, blue for missing, yellow for crossing missing)")
-        print("   %s <gold> <test> <output_prefix>" % sys.argv[0])
+        print("   %s <gold> <test> <output_prefix> [--shard i/N] [--sentences 5,10-20,...]" % sys.argv[0])
         print("Running doctest")
         import doctest
         doctest.testmod()
@@ -35,13 +37,30 @@ if __name__ == '__main__':
         'out': sys.stdout,
         'tex': sys.stdout
     }
-    if len(sys.argv) > 3:
-        prefix = sys.argv[3]
+    if len(args) > 3:
+        prefix = args[3]
         for key in out:
             out[key] = open(prefix + '.' + key, 'w')
-    gold_in = open(sys.argv[1])
-    test_in = open(sys.argv[2])
-    sent_no = 0
+    gold_in = tree_store.open_lines(args[1])
+    test_in = tree_store.open_lines(args[2])
+    shard = None
+    if options['shard'] is not None:
+        success, shard = init.get_shard(options['shard'])
+        if not success:
+            print(shard, file=sys.stderr)
+            sys.exit(1)
+        first, last = init.shard_range(shard, tree_store.count_lines(args[1]))
+    if options['sentences'] is not None:
+        if shard is not None:
+            print("--sentences cannot be used with --shard", file=sys.stderr)
+            sys.exit(1)
+        success, ranges = init.get_sentences(options['sentences'])
+        if not success:
+            print(ranges, file=sys.stderr)
+            sys.exit(1)
+        sentences = tree_index.selected_lines(args[1:3], ranges)
+    else:
+        sentences = ((sent_no, [gold_in.readline(), test_in.readline()]) for sent_no in itertools.count(1))
     stats = {
         'out': [0, 0, 0]
     }
@@ -74,20 +93,27 @@ if __name__ == '__main__':
 \\begin{document}
 \\maketitle'''
     mprint(tex_start, out, 'tex')
+    starts = {}
+    for key in out:
+        out[key].flush()
+        starts[key] = out[key].tell()
 
-    while True:
-        sent_no += 1
-        gold_text = gold_in.readline()
-        test_text = test_in.readline()
+    note = None
+    for sent_no, (gold_text, test_text) in sentences:
         if gold_text == '' and test_text == '':
-            mprint("End of both input files", out, 'err')
+            note = "End of both input files"
             break
         elif gold_text == '':
-            mprint("End of gold input", out, 'err')
+            note = "End of gold input"
             break
         elif test_text == '':
-            mprint("End of test input", out, 'err')
+            note = "End of test input"
             break
+        if shard is not None:
+            if sent_no > last:
+                break
+            if sent_no < first:
+                continue
 
         mprint("Sentence %d:" % sent_no, out, 'all')
 
@@ -156,6 +182,26 @@ if __name__ == '__main__':
         mprint( '}\n\\small\n(b) Gold tree\n\\pagebreak', out, 'tex')
 
         mprint("", out, 'all')
+    if shard is not None:
+        # Everything merge_shards.py needs to combine this run with the others
+        ends = {}
+        for key in out:
+            out[key].flush()
+            ends[key] = out[key].tell()
+        result_cache.write_json(prefix + '.shard', {
+            'kind': 'coloured',
+            'shard': shard,
+            'settings': [args[1:], []],
+            'names': [''],
+            'files': [[key, '.' + key] for key in out],
+            'headers': [dict((key, 0) for key in out)],
+            'starts': [starts],
+            'ends': [ends],
+            'notes': [note] if note is not None else [],
+            'totals': stats['out']
+        })
+    if note is not None:
+        mprint(note, out, 'err')
     match = stats['out'][0]
     gold = stats['out'][1]
     test = stats['out'][2]
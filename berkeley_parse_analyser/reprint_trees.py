@@ -2,9 +2,11 @@
 # -*- coding: utf-8 -*-
 # vim: set ts=2 sw=2 noet:
 
+import shutil
 import sys
+import tempfile
 
-from .nlp_util import pstree, treebanks, render_tree
+from .nlp_util import pstree, treebanks, render_tree, init
 
 tex_start = '''\\documentclass[11pt]{article}
 \\usepackage{times}
@@ -34,6 +36,30 @@ tex_start = '''\\documentclass[11pt]{article}
 \\begin{document}
 \\maketitle'''
 
+def apply_edits(tree, edits):
+    '''Apply the edits named by the letters in edits (see the help below) to
+    a tree, returning the edited tree.'''
+    if 'h' in edits:
+        tree = treebanks.homogenise_tree(tree)
+    if 't' in edits:
+        treebanks.remove_traces(tree)
+    if 'f' in edits:
+        treebanks.remove_function_tags(tree)
+    if 'c' in edits:
+        treebanks.apply_collins_rules(tree)
+    if 'u' in edits:
+        # This must be after all other deletion to work properly
+        treebanks.remove_trivial_unaries(tree)
+    return tree
+
+def count_trees(source):
+    '''Count the trees in a file, as generate_trees would read them (including
+    empty ones), without building them, and go back to the start of the file.
+    '''
+    count = sum(1 for span in treebanks.ptb_tree_spans(source))
+    source.seek(0)
+    return count
+
 def get_args():
     args = {}
     i = 1
@@ -58,6 +84,8 @@ if __name__ == '__main__':
         print("  -(o)utput = (s)ingle_line | (m)ulti_line | (t)ex | (w)ords | (o)ntonotes | (p)os tagged")
         print("  -(e)dit = remove (t)races, remove (f)unction tags, apply (c)ollins rules, (h)omogenise top, remove trivial (u)naries")
         print("  -(g)old = <gold filenmae>")
+        print("  -(s)hard = i/N, only print the i-th of N equal parts of the trees (the parts")
+        print("             can be joined with cat)")
         print("\ne.g. %s -f t -e tf -g trees_gold < trees_in > trees_out" % sys.argv[0])
         sys.exit(0)
 
@@ -68,39 +96,41 @@ if __name__ == '__main__':
     if gold_file is not None:
         gold_file = treebanks.generate_trees(gold_file, allow_empty_labels=True)
 
-    if out_format == 't':
+    source = sys.stdin
+    shard = None
+    if 's' in args:
+        success, shard = init.get_shard(args['s'])
+        if not success:
+            print(shard, file=sys.stderr)
+            sys.exit(1)
+        # The trees are counted first, so input from a pipe is kept in a
+        # temporary file to be read again
+        if not source.seekable():
+            source = tempfile.TemporaryFile('w+')
+            shutil.copyfileobj(sys.stdin, source)
+            source.seek(0)
+        first, last = init.shard_range(shard, count_trees(source))
+    trees = treebanks.generate_trees(source, return_empty=True, allow_empty_labels=True)
+
+    # With shards, only the first starts the document and only the last ends it
+    if out_format == 't' and (shard is None or shard[0] == 1):
         print(tex_start)
-    for tree in treebanks.generate_trees(sys.stdin, return_empty=True, allow_empty_labels=True):
+    for tree_no, tree in enumerate(trees, 1):
         gold_tree = None
         if gold_file is not None:
-            gold_tree = gold_file.next()
+            gold_tree = next(gold_file)
+        if shard is not None and tree_no > last:
+            break
+        if shard is not None and tree_no < first:
+            continue
 
         if tree is None:
             print
             continue
 
-        # Apply edits
-        if 'h' in edits:
-            tree = treebanks.homogenise_tree(tree)
-            if gold_tree is not None:
-                gold_tree = treebanks.homogenise_tree(gold_tree)
-        if 't' in edits:
-            treebanks.remove_traces(tree)
-            if gold_tree is not None:
-                treebanks.remove_traces(gold_tree)
-        if 'f' in edits:
-            treebanks.remove_function_tags(tree)
-            if gold_tree is not None:
-                treebanks.remove_function_tags(gold_tree)
-        if 'c' in edits:
-            treebanks.apply_collins_rules(tree)
-            if gold_tree is not None:
-                treebanks.apply_collins_rules(gold_tree)
-        if 'u' in edits:
-            # This must be after all other deletion to work properly
-            treebanks.remove_trivial_unaries(tree)
-            if gold_tree is not None:
-                treebanks.remove_trivial_unaries(gold_tree)
+        tree = apply_edits(tree, edits)
+        if gold_tree is not None:
+            gold_tree = apply_edits(gold_tree, edits)
 
         # Print tree
         if out_format == 's':
@@ -127,5 +157,5 @@ if __name__ == '__main__':
                 print('}\n\\small\n\\pagebreak')
         elif out_format == 'w':
             print(render_tree.text_words(tree))
-    if out_format == 't':
+    if out_format == 't' and (shard is None or shard[0] == shard[1]):
         print('\\end{document}')
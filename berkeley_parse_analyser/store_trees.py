@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 noet:
+
+import sys
+
+from .nlp_util import treebanks, render_tree, init, tree_store
+from .reprint_trees import apply_edits
+
+if __name__ == '__main__':
+    args, options = init.get_options(sys.argv, {'edit': '', 'print': False})
+    if not (len(args) == 3 or (options['print'] and len(args) == 2)):
+        print("Read a file of trees, apply edits, and store the trees in a binary file that")
+        print("can be loaded without parsing or editing them again (see nlp_util/tree_store.py).")
+        print("   %s [--edit EDITS] <trees_in> <trees_out>" % sys.argv[0])
+        print("   %s --print <trees_file>" % sys.argv[0])
+        print("Options:")
+        print("  --edit = letters for the edits to apply, as for reprint_trees.py: remove (t)races,")
+        print("           remove (f)unction tags, apply (c)ollins rules, (h)omogenise top,")
+        print("           remove trivial (u)naries")
+        print("  --print  print the trees in a binary file, one per line (with () for empty trees)")
+        print("\ne.g. %s --edit hc sample_data/wsj01.mrg wsj01.trees" % sys.argv[0])
+        sys.exit(0)
+
+    if options['print']:
+        for tree in tree_store.read_trees(args[1]):
+            if tree is None:
+                print("()")
+            else:
+                print(render_tree.text_tree(tree, single_line=True))
+        sys.exit(0)
+
+    def edited_trees():
+        for tree in treebanks.generate_trees(args[1], return_empty=True, allow_empty_labels=True):
+            if tree is not None:
+                tree = apply_edits(tree, options['edit'])
+                tree.calculate_spans()
+            yield tree
+    tree_store.write_trees(args[2], edited_trees())
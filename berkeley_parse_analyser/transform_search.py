@@ -4,10 +4,18 @@
 
 import sys
 from collections import defaultdict
+import csv
 import functools
+import heapq
+import inspect
 import io
+import json
+import multiprocessing
+import os
+import socketserver
+import time
 
-from nlp_util import pstree, render_tree, init, treebanks, parse_errors, head_finder, tree_transform
+from nlp_util import pstree, render_tree, init, treebanks, parse_errors, head_finder, tree_transform, result_cache, flat_tree, tree_index, tree_store
 
 def get_label(tree):
     if tree.word is None:
@@ -32,11 +40,13 @@ def get_preterminals(tree, ans=None):
         return tuple(ans)
 
 
-def gen_different_label_successor(ctree, span, cur_label, new_label):
+def gen_different_label_successor(ctree, span, cur_label, new_label, with_info=True):
     success, response = tree_transform.change_label(ctree, new_label, span, cur_label, False)
     assert success, response
 
     ntree, nnode = response
+    if not with_info:
+        return (True, ntree, None)
 
     info = {
         'type': 'relabel',
@@ -53,11 +63,13 @@ def gen_different_label_successor(ctree, span, cur_label, new_label):
     return (True, ntree, info)
 
 
-def gen_missing_successor(ctree, error):
+def gen_missing_successor(ctree, error, with_info=True):
     success, response = tree_transform.add_node(ctree, error[1], error[2], in_place=False)
     assert success, response
 
     ntree, nnode = response
+    if not with_info:
+        return (True, ntree, None)
     nnode_index = nnode.parent.subtrees.index(nnode)
 
     info = {
@@ -78,12 +90,14 @@ def gen_missing_successor(ctree, error):
     return (True, ntree, info)
 
 
-def gen_extra_successor(ctree, error, gold):
+def gen_extra_successor(ctree, error, gold, with_info=True):
     success, response = tree_transform.remove_node(ctree, error[1], error[2], in_place=False)
     assert success, response
 
     parent, dnode, spos, epos  = response
     ntree = parent.root()
+    if not with_info:
+        return (True, ntree, None)
 
     info = {
         'type': 'remove',
@@ -112,11 +126,59 @@ def gen_extra_successor(ctree, error, gold):
     return (True, ntree, info)
 
 
-def gen_move_successor(source_span, left, right, new_parent, cerrors, gold):
+def get_move_edit(source_span, left, right, new_parent, cerrors):
+    '''Work out the brackets that moving children left to right of source_span
+    to new_parent would remove and add, by making the move in place and then
+    undoing it.'''
+    edits = []
+    success, response = tree_transform.move_nodes(source_span.subtrees[left:right+1], new_parent, edits=edits)
+    assert success, response
+
+    ntree, nodes, new_parent = response
+    removed = edits[0].removed
+    added = edits[0].added[:]
+
+    # Consider fixing a missing node in the new location as well
+    fix = None
+    to_fix = None
+    for error in cerrors.missing_after(removed, added):
+        if error[1][0] <= nodes[0].span[0] and nodes[-1].span[1] <= error[1][1]:
+            if error[1] == (nodes[0].span[0], nodes[-1].span[1]):
+                continue
+            if error[1][0] < new_parent.span[0] or error[1][1] > new_parent.span[1]:
+                continue
+            if to_fix is None or to_fix[1][0] < error[1][0] or error[1][1] < to_fix[1][1]:
+                to_fix = error
+    tree_transform.undo(edits)
+
+    if to_fix is not None:
+        fix = (to_fix, error[2])
+        added.append(parse_errors.bracket(to_fix[3]))
+
+    return removed, added, fix
+
+
+def gen_move_successor(source_span, left, right, new_parent, fix, gold, with_info=True):
     success, response = tree_transform.move_nodes(source_span.subtrees[left:right+1], new_parent, False)
     assert success, response
 
     ntree, nodes, new_parent = response
+    info = None
+    if with_info:
+        info = get_move_info(source_span, left, right, nodes, new_parent, fix, gold)
+
+    if fix is not None:
+        to_fix = fix[0]
+        success, response = tree_transform.add_node(ntree, to_fix[1], to_fix[2])
+        assert success, response
+        ntree, nnode = response
+
+    return (False, ntree, info)
+
+
+def get_move_info(source_span, left, right, nodes, new_parent, fix, gold):
+    '''Describe a move, given the tree after nodes have moved to new_parent, but
+    before any node in fix is added.'''
     new_left = new_parent.subtrees.index(nodes[0])
     new_right = new_parent.subtrees.index(nodes[-1])
 
@@ -150,20 +212,10 @@ def gen_move_successor(source_span, left, right, new_parent, cerrors, gold):
         if gold_eq is not None:
             info['POS confusion'] = (get_label(preterminal), get_label(gold_eq))
 
-    # Consider fixing a missing node in the new location as well
-    nerrors = parse_errors.ParseErrorSet(gold, ntree)
-    to_fix = None
-    for error in nerrors.missing:
-        if error[1][0] <= nodes[0].span[0] and nodes[-1].span[1] <= error[1][1]:
-            if error[1] == (nodes[0].span[0], nodes[-1].span[1]):
-                continue
-            if error[1][0] < new_parent.span[0] or error[1][1] > new_parent.span[1]:
-                continue
-            if to_fix is None or to_fix[1][0] < error[1][0] or error[1][1] < to_fix[1][1]:
-                to_fix = error
-    if to_fix is not None:
+    if fix is not None:
+        to_fix = fix[0]
         info['added and moved'] = True
-        info['added label'] = error[2]
+        info['added label'] = fix[1]
 
         unmoved = []
         for node in new_parent.subtrees:
@@ -174,30 +226,120 @@ def gen_move_successor(source_span, left, right, new_parent, cerrors, gold):
         if len(unmoved) == 1 and unmoved[0].label == to_fix[2]:
             info['adding node already present'] = True
 
-        success, response = tree_transform.add_node(ntree, to_fix[1], to_fix[2], in_place=False)
-        assert success, response
-        ntree, nnode = response
-
-    return (False, ntree, info)
+    return info
             
 
-def successors(ctree, cerrors, gold):
+def index_extra(ctree, cerrors):
+    '''Find the nodes in ctree that cerrors marks as extra, returning them as a
+    set, and as dicts from start and from end positions to lists of nodes.
+    Nodes sharing an endpoint are nested, so each list is highest first, as
+    get_nodes would give them.'''
+    extra = set()
+    by_start = {}
+    by_end = {}
+    for node in ctree:
+        if cerrors.is_extra(node):
+            extra.add(node)
+            by_start.setdefault(node.span[0], []).append(node)
+            by_end.setdefault(node.span[1], []).append(node)
+    return extra, by_start, by_end
+
+
+def error_regions(ctree, cerrors):
+    '''Divide the errors in ctree into independent regions.  Each error starts
+    with the lowest node whose span strictly contains it, and regions are merged
+    when one of these nodes is inside another.  Changes within a region do not
+    alter brackets outside it, so regions can be fixed one at a time.  Returns a
+    list of (root node, missing errors, extra errors), from left to right.
+
+    >>> gold = pstree.tree_from_text("(ROOT (S (NP (NP (DT The) (NN cat)) (PP (IN in) (NP (DT the) (NN hat)))) (VP (VBD sat) (PP (IN on) (NP (DT the) (NN mat))))))")
+    >>> test = pstree.tree_from_text("(ROOT (S (NP (DT The) (NN cat) (PP (IN in) (NP (DT the) (NN hat)))) (VP (VBD sat) (PP (IN on) (DT the) (NN mat)))))")
+    >>> cerrors = parse_errors.ParseErrorSet(gold, test)
+    >>> regions = error_regions(test, cerrors)
+    >>> [(region[0].label, region[0].span, [error[1] for error in region[1]]) for region in regions]
+    [('NP', (0, 5), [(0, 2)]), ('PP', (6, 9), [(7, 9)])]
+
+    Changes are only sought within the region given to successors, and
+    fixing the regions in turn reaches the gold tree:
+
+    >>> [edit for edit, successor in successors(test, cerrors, gold, regions[0])]
+    [([], [(0, 2, 'NP')])]
+    >>> def label_with_type(info, gold, test):
+    ...     info['classified_type'] = info['type']
+    >>> counts, path = greedy_search(gold, test, label_with_type, regions=True)
+    >>> [step[1]['classified_type'] for step in path]
+    ['init', 'add', 'add']
+    >>> repr(path[-1][0]) == repr(gold)
+    True
+    '''
+    roots = {}
+    for error in cerrors.missing + cerrors.crossing + cerrors.extra:
+        start, end = error[1]
+        node = ctree
+        lower = True
+        while lower:
+            lower = False
+            for subtree in node.subtrees:
+                if subtree.span[0] <= start and end <= subtree.span[1] and subtree.span != error[1]:
+                    node = subtree
+                    lower = True
+                    break
+        roots.setdefault(node, []).append(error)
+
+    regions = {}
+    for node in roots:
+        top = node
+        ancestor = node.parent
+        while ancestor is not None:
+            if ancestor in roots:
+                top = ancestor
+            ancestor = ancestor.parent
+        regions.setdefault(top, []).extend(roots[node])
+
+    ans = []
+    for root in sorted(regions, key=lambda node: node.span):
+        errors = set(regions[root])
+        missing = [error for error in cerrors.missing if error in errors]
+        extra = [error for error in cerrors.extra if error in errors]
+        ans.append((root, missing, extra))
+    return ans
+
+
+def successors(ctree, cerrors, gold, region=None):
+    '''Generate the possible changes to ctree as pairs of the brackets the
+    change would remove and add, and a function that creates the new tree and its
+    info.  Trees are only created when needed.  If a region from error_regions
+    is given, only changes within it are considered.'''
+    missing = cerrors.missing
+    extra_errors = cerrors.extra
+    sources = ctree
+    if region is not None:
+        sources, missing, extra_errors = region
+        in_region = set(sources)
+
     # Change the label of a node
-    for merror in cerrors.missing:
-        for eerror in cerrors.extra:
+    for merror in missing:
+        for eerror in extra_errors:
             if merror[1] == eerror[1]:
-                yield gen_different_label_successor(ctree, eerror[1], eerror[2], merror[2])
+                edit = ([eerror[1] + (eerror[2],)], [merror[1] + (merror[2],)])
+                count_stat('relabel')
+                yield edit, functools.partial(gen_different_label_successor, ctree, eerror[1], eerror[2], merror[2])
 
     # Add a node
-    for error in cerrors.missing:
-        yield gen_missing_successor(ctree, error)
+    for error in missing:
+        edit = ([], [error[1] + (error[2],)])
+        count_stat('add')
+        yield edit, functools.partial(gen_missing_successor, ctree, error)
 
     # Remove a node
-    for error in cerrors.extra:
-        yield gen_extra_successor(ctree, error, gold)
+    for error in extra_errors:
+        edit = ([error[1] + (error[2],)], [])
+        count_stat('remove')
+        yield edit, functools.partial(gen_extra_successor, ctree, error, gold)
 
     # Move nodes
-    for source_span in ctree:
+    extra, extra_by_start, extra_by_end = index_extra(sources, cerrors)
+    for source_span in sources:
         # Consider all continuous sets of children
         for left in range(len(source_span.subtrees)):
             for right in range(left, len(source_span.subtrees)):
@@ -211,31 +353,25 @@ def successors(ctree, cerrors, gold):
                 if left != 0:
                     new_parent = source_span.subtrees[left-1]
                     while not new_parent.is_terminal():
-                        if cerrors.is_extra(new_parent):
+                        if new_parent in extra:
                             new_parents.append(new_parent)
                         new_parent = new_parent.subtrees[-1]
                 if right != len(source_span.subtrees) - 1:
                     new_parent = source_span.subtrees[right+1]
                     while not new_parent.is_terminal():
-                        if cerrors.is_extra(new_parent):
+                        if new_parent in extra:
                             new_parents.append(new_parent)
                         new_parent = new_parent.subtrees[0]
 
                 # If source_span is extra
-                if cerrors.is_extra(source_span) and (left == 0 or right == len(source_span.subtrees) - 1):
+                if source_span in extra and (left == 0 or right == len(source_span.subtrees) - 1):
                     # Consider moving this set out to the left
                     if left == 0:
-                        if source_span.subtrees[left].span[0] > 0:
-                            for new_parent in ctree.get_nodes('all', end=source_span.subtrees[left].span[0]):
-                                if cerrors.is_extra(new_parent):
-                                    new_parents.append(new_parent)
+                        new_parents += extra_by_end.get(source_span.subtrees[left].span[0], [])
 
                     # Consider moving this set out to the right
                     if right == len(source_span.subtrees) - 1:
-                        if source_span.subtrees[right].span[1] < ctree.span[1]:
-                            for new_parent in ctree.get_nodes('all', start=source_span.subtrees[right].span[1]):
-                                if cerrors.is_extra(new_parent):
-                                    new_parents.append(new_parent)
+                        new_parents += extra_by_start.get(source_span.subtrees[right].span[1], [])
 
                     # Consider moving this set of spans up
                     if left == 0:
@@ -255,21 +391,79 @@ def successors(ctree, cerrors, gold):
                                 break
                             new_parent = new_parent.parent
 
+                if region is not None:
+                    new_parents = [node for node in new_parents if node in in_region]
                 for new_parent in new_parents:
-                    yield gen_move_successor(source_span, left, right, new_parent, cerrors, gold)
+                    removed, added, fix = get_move_edit(source_span, left, right, new_parent, cerrors)
+                    count_stat('move')
+                    yield (removed, added), functools.partial(gen_move_successor, source_span, left, right, new_parent, fix, gold)
+
+
+class Budget:
+    '''Limits on the search for one sentence: the number of iterations, the
+    time in seconds, and the number of successors scored.  Limits of zero are
+    ignored.  As before there were budgets, a search may make max_iterations
+    changes, and then one more, before it stops.  The errors left when a search
+    stops are put down to the limit in a final Unexplained step.
+
+    >>> def label_with_type(info, gold, test):
+    ...     info['classified_type'] = info['type']
+    >>> gold = "(ROOT (S (NP (DT The) (NN cat)) (VP (VBD sat) (PP (IN on) (NP (DT the) (NN mat))))))"
+    >>> test = "(ROOT (FRAG (NP (DT The)) (NN cat) (VBD sat) (ADVP (IN on) (DT the) (NN mat))))"
+    >>> search = functools.partial(greedy_search, max_iterations=1)
+    >>> texts, counts = compare_sentence(gold, test, label_with_type, search)
+    >>> [line for line in texts['out'].splitlines() if 'Error:' in line]
+    ['2 Error:relabel', '2 Error:relabel', '4 Error:Unexplained']
+    >>> print(texts['err'].splitlines()[1])
+    Search stopped by the iterations limit
+    '''
+    def __init__(self, max_iterations=100, max_time=0, max_successors=0):
+        self.max_iterations = max_iterations
+        self.max_successors = max_successors
+        self.deadline = None
+        if max_time > 0:
+            self.deadline = time.time() + max_time
+        self.successors = 0
+
+    def exceeded(self, iterations=0):
+        '''The name of a limit that has been reached, or None.'''
+        if 0 < self.max_iterations < iterations:
+            return 'iterations'
+        if 0 < self.max_successors <= self.successors:
+            return 'successors'
+        if self.deadline is not None and time.time() > self.deadline:
+            return 'time'
+        return None
+
 
+def unexplained_step(tree, cerrors, limit):
+    '''A final step for a search that stopped before fixing every error, which
+    attributes the errors that are left to the limit that was reached.'''
+    info = {
+        'type': 'unexplained',
+        'limit': limit,
+        'classified_type': 'Unexplained'
+    }
+    return (tree, info, len(cerrors))
 
-def greedy_search(gold, test, classify):
+
+def greedy_search(gold, test, classify, max_iterations=100, max_time=0, max_successors=0, regions=False):
+    '''Repeatedly make the change that fixes the most errors.  With regions,
+    changes are only sought in the first independent region of errors (falling
+    back to the whole tree if nothing there helps), so the cost of each step
+    depends on the size of that region rather than the sentence.'''
     # Initialise with the test tree
     cur = (test.clone(), {'type': 'init'}, 0)
+    budget = Budget(max_iterations, max_time, max_successors)
 
     # Search while there is still something in the fringe
     iters = 0
     path = []
+    visited = set()
+    table = [0, 0]
+    unexplained = None
     while True:
         path.append(cur)
-        if iters > 100:
-            return (0, iters), None
         # Check for victory
         ctree = cur[0]
         cerrors = parse_errors.ParseErrorSet(gold, ctree)
@@ -277,59 +471,424 @@ def greedy_search(gold, test, classify):
             final = cur
             break
 
+        # Successors that give the same brackets are only scored once, and ones
+        # that return to a tree already on the path are skipped
+        visited.add(cerrors.test_hash)
+        scored = set()
         best = None
-        for fixes, ntree, info in successors(ctree, cerrors, gold):
-            if not ntree.check_consistency():
-                raise Exception("Inconsistent tree! {}".format(ntree))
-            nerrors = parse_errors.get_errors(ntree, gold)
-            change = len(cerrors) - len(nerrors)
-            if change < 0:
-                continue
-            if best is None or change > best[2]:
-                best = (ntree, info, change)
-        cur = best
+        limit = budget.exceeded(iters)
+        areas = [None]
+        if regions:
+            areas = error_regions(ctree, cerrors)[:1] + areas
+        for area in areas:
+            if limit is not None or best is not None:
+                break
+            for edit, successor in successors(ctree, cerrors, gold, area):
+                if repeated_state(cerrors.hash_after(*edit), table, visited, scored):
+                    continue
+                budget.successors += 1
+                change = -cerrors.count_change(*edit)
+                if change < 0:
+                    count_stat('rejected')
+                elif best is None or change > best[1]:
+                    best = (successor, change)
+                limit = budget.exceeded(iters)
+                if limit is not None:
+                    break
+        if limit is None and best is None:
+            limit = 'dead end'
+
+        # Stop with the path so far if the budget has run out
+        if limit is not None:
+            unexplained = unexplained_step(ctree, cerrors, limit)
+            break
+
+        # Only the chosen successor is actually constructed
+        fixes, ntree, info = best[0]()
+        if not ntree.check_consistency():
+            raise Exception("Inconsistent tree! {}".format(ntree))
+        cur = (ntree, info, best[1])
         iters += 1
     
     for step in path:
         classify(step[1], gold, test)
+    if unexplained is not None:
+        path.append(unexplained)
     
-    return (0, iters), path
+    return (0, iters) + tuple(table), path
+
+
+def repeated_state(state, table, *seen):
+    '''Check whether a state hash is in any of the seen sets, adding it to the
+    last of them if not.  table counts [repeats, lookups].'''
+    table[1] += 1
+    for states in seen:
+        if state in states:
+            table[0] += 1
+            return True
+    seen[-1].add(state)
+    return False
+
+
+def build_state(successor, change, parent):
+    '''Construct a successor tree, as a (tree, info, change, parent, successor)
+    state.  The info is left as None, as most states are not on the final path.'''
+    fixes, ntree, info = successor(with_info=False)
+    if not ntree.check_consistency():
+        raise Exception("Inconsistent tree! {}".format(ntree))
+    return (ntree, info, change, parent, successor)
+
+
+def state_path(state, gold, test, classify, unexplained=None):
+    '''Follow parent links back to the test tree, constructing the info for
+    each step and classifying it.  An unexplained step goes on the end.'''
+    path = []
+    while state is not None:
+        if state[1] is None:
+            fixes, ntree, info = state[4]()
+            path.append((ntree, info, state[2]))
+        else:
+            path.append(state[:3])
+        state = state[3]
+    path.reverse()
+    for step in path:
+        classify(step[1], gold, test)
+    if unexplained is not None:
+        path.append(unexplained)
+    return path
+
+
+def beam_search(gold, test, classify, width=5, max_expansions=1000, max_iterations=100, max_time=0, max_successors=0):
+    '''Keep the best width trees at each step, rather than only one.  Candidates
+    are ranked by the number of errors they leave, with ties going to the
+    earliest generated, so a width of one makes the same choices as
+    greedy_search.  Trees already expanded are not added again.  Returns
+    ((beam size, trees expanded, repeated states, successors), path).  If a
+    limit is reached first the path leads to the best tree in the beam.
+
+    >>> gold = pstree.tree_from_text("(ROOT (S (NP (DT The) (NN cat)) (VP (VBD sat) (PP (IN on) (NP (DT the) (NN mat))))))")
+    >>> test = pstree.tree_from_text("(ROOT (S (NP (DT The) (NN cat) (VBD sat)) (PP (IN on) (NP (DT the) (NN mat)))))")
+    >>> def label_with_type(info, gold, test):
+    ...     info['classified_type'] = info['type']
+    >>> counts, path = beam_search(gold, test, label_with_type, width=3)
+    >>> [step[1]['classified_type'] for step in path]
+    ['init', 'move']
+    >>> repr(path[-1][0]) == repr(gold)
+    True
+    '''
+    beam = [(test.clone(), {'type': 'init'}, 0, None, None)]
+    budget = Budget(max_iterations, max_time, max_successors)
+    expansions = 0
+    visited = set()
+    table = [0, 0]
+    depth = 0
+    while True:
+        # Check for victory
+        beam_errors = []
+        for state in beam:
+            cerrors = parse_errors.ParseErrorSet(gold, state[0])
+            if len(cerrors) == 0:
+                return (len(beam), expansions) + tuple(table), state_path(state, gold, test, classify)
+            beam_errors.append(cerrors)
+            visited.add(cerrors.test_hash)
+
+        candidates = []
+        scored = set()
+        limit = budget.exceeded(depth)
+        for state, cerrors in zip(beam, beam_errors):
+            if limit is not None:
+                break
+            if expansions >= max_expansions:
+                limit = 'expansions'
+                break
+            expansions += 1
+            for edit, successor in successors(state[0], cerrors, gold):
+                if repeated_state(cerrors.hash_after(*edit), table, visited, scored):
+                    continue
+                budget.successors += 1
+                change = -cerrors.count_change(*edit)
+                if change < 0:
+                    count_stat('rejected')
+                else:
+                    candidates.append((len(cerrors) - change, len(candidates), successor, change, state))
+                limit = budget.exceeded(depth)
+                if limit is not None:
+                    break
+        if limit is None and len(candidates) == 0:
+            limit = 'dead end'
+
+        # Stop with the best tree so far if the budget has run out
+        if limit is not None:
+            unexplained = unexplained_step(beam[0][0], beam_errors[0], limit)
+            return (len(beam), expansions) + tuple(table), state_path(beam[0], gold, test, classify, unexplained)
+
+        # Only the trees that stay in the beam are actually constructed
+        candidates.sort(key=lambda candidate: candidate[:2])
+        beam = [build_state(*candidate[2:]) for candidate in candidates[:width]]
+        depth += 1
+
+
+def best_first_search(gold, test, classify, max_fringe=10000, max_expansions=1000, max_time=0, max_successors=0):
+    '''Best-first search for a short sequence of changes, expanding trees in
+    order of the number of changes made to reach them plus the number of errors
+    left.  Every change costs one, however many brackets it adds and removes, so
+    a move that fixes several errors is preferred to the separate additions and
+    removals that would reach the same tree (as in greedy_search).  This is not
+    A* search: one change can fix several errors, so the errors left may
+    overestimate the changes still needed, and the path found is not guaranteed
+    to be the shortest.  (The only estimate that cannot overestimate, one
+    change while any errors are left, expands dozens of times as many trees,
+    and on the sample data some sentences reach the expansion limit.)  Successors
+    are only constructed when they are taken off the fringe, and once the fringe
+    holds more than max_fringe entries the worst are dropped.  Trees already
+    expanded, or already on the fringe at no greater cost, are not added.
+    Returns ((fringe size, trees expanded, repeated states, successors), path).
+    If a limit is reached first the path leads to the expanded tree with the
+    fewest errors.
+
+    >>> gold = pstree.tree_from_text("(ROOT (S (NP (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti)))))")
+    >>> test = pstree.tree_from_text("(ROOT (S (NP (NNP Ms.)) (VP (NNP Haag) (VBZ plays) (NP (NNP Elianti)))))")
+    >>> def label_with_type(info, gold, test):
+    ...     info['classified_type'] = info['type']
+    >>> counts, path = best_first_search(gold, test, label_with_type)
+    >>> [step[1]['classified_type'] for step in path]
+    ['init', 'move']
+    >>> path[-1][0]
+    (ROOT (S (NP (NNP Ms.) (NNP Haag)) (VP (VBZ plays) (NP (NNP Elianti)))))
+    '''
+    # Entries are (estimated total, errors left, order, cost, state hash,
+    # successor, change, parent)
+    fringe = [(0, 0, 0, 0, None, None, 0, None)]
+    budget = Budget(0, max_time, max_successors)
+    count = 1
+    expansions = 0
+    closed = set()
+    costs = {}
+    table = [0, 0]
+    best = None
+    limit = 'dead end'
+    while len(fringe) > 0:
+        estimate, remaining, order, cost, key, successor, change, parent = heapq.heappop(fringe)
+        if key in closed:
+            # Reached more cheaply since this entry was added
+            continue
+        if successor is None:
+            state = (test.clone(), {'type': 'init'}, 0, None, None)
+        else:
+            state = build_state(successor, change, parent)
+
+        # Check for victory
+        cerrors = parse_errors.ParseErrorSet(gold, state[0])
+        if len(cerrors) == 0:
+            return (len(fringe), expansions) + tuple(table), state_path(state, gold, test, classify)
+        if best is None or len(cerrors) < len(best[1]):
+            best = (state, cerrors)
+        if expansions >= max_expansions:
+            limit = 'expansions'
+            break
+        limit = budget.exceeded()
+        if limit is not None:
+            break
+        expansions += 1
+        closed.add(cerrors.test_hash)
+
+        for edit, successor in successors(state[0], cerrors, gold):
+            key = cerrors.hash_after(*edit)
+            ncost = cost + 1
+            table[1] += 1
+            if key in closed or costs.get(key, ncost + 1) <= ncost:
+                table[0] += 1
+                continue
+            budget.successors += 1
+            change = -cerrors.count_change(*edit)
+            if change < 0:
+                count_stat('rejected')
+                continue
+            costs[key] = ncost
+            remaining = len(cerrors) - change
+            heapq.heappush(fringe, (ncost + remaining, remaining, count, ncost, key, successor, change, state))
+            count += 1
+        if len(fringe) > max_fringe:
+            fringe = heapq.nsmallest(max_fringe, fringe)
+
+    # Stop with the best tree so far if the budget has run out
+    unexplained = unexplained_step(best[0][0], best[1], limit)
+    return (len(fringe), expansions) + tuple(table), state_path(best[0], gold, test, classify, unexplained)
+
+
+SEARCHES = {
+    'greedy': greedy_search,
+    'regions': greedy_search,
+    'beam': beam_search,
+    'bestfirst': best_first_search
+}
+
+def get_search(options):
+    '''Choose the search function described by the command line options.'''
+    name = options['search']
+    if name not in SEARCHES:
+        return (False, "Unknown search '{}', options are: {}".format(name, ' '.join(sorted(SEARCHES))))
+    settings = {
+        'max_time': options['max-time'],
+        'max_successors': options['max-successors']
+    }
+    if name != 'bestfirst':
+        settings['max_iterations'] = options['max-iterations']
+    if name == 'regions':
+        settings['regions'] = True
+    if name == 'beam':
+        settings['width'] = options['beam']
+    if name in ['beam', 'bestfirst']:
+        settings['max_expansions'] = options['max-expansions']
+    if name == 'bestfirst':
+        settings['max_fringe'] = options['max-fringe']
+    return (True, functools.partial(SEARCHES[name], **settings))
+
+
+# Counters and timings for the sentence being compared, when stats are enabled
+stats_enabled = False
+sentence_stats = None
+
+STATS_FIELDS = [
+    'time total', 'time search', 'time classify', 'time get_errors',
+    'time clone_and_find', 'time check_consistency', 'iterations',
+    'relabel', 'add', 'remove', 'move', 'rejected', 'repeated'
+]
+
+def count_stat(name, amount=1):
+    if sentence_stats is not None:
+        sentence_stats[name] += amount
+
+
+def timed(name, function):
+    '''Wrap function so that the time spent in it is added to the sentence
+    stats.  Calls made from inside the function (as in recursion) are not
+    counted again.'''
+    active = [False]
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if sentence_stats is None or active[0]:
+            return function(*args, **kwargs)
+        active[0] = True
+        start = time.time()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            sentence_stats['time ' + name] += time.time() - start
+            active[0] = False
+    return wrapper
+
+
+def enable_stats():
+    '''Start collecting stats, timing the library functions that dominate the
+    search.  The wrappers are only installed when asked for, so runs without
+    stats pay nothing for them.'''
+    global stats_enabled
+    if stats_enabled:
+        return
+    stats_enabled = True
+    tree_transform.clone_and_find = timed('clone_and_find', tree_transform.clone_and_find)
+    pstree.PSTree.check_consistency = timed('check_consistency', pstree.PSTree.check_consistency)
+    get_errors = timed('get_errors', parse_errors.get_errors)
+    parse_errors.get_errors = get_errors
+    render_tree.get_errors = get_errors
+
 
+def write_stats(prefix, rows, cached, repeated):
+    '''Write the stats for each sentence searched to <prefix>.stats.csv, and
+    both those and the totals for the run to <prefix>.stats.json.  Timings are
+    in seconds, and the search time includes the time spent classifying.'''
+    with open(prefix + '.stats.csv', 'w') as out:
+        writer = csv.writer(out)
+        writer.writerow(['sentence'] + STATS_FIELDS)
+        for sent_no, stats in rows:
+            writer.writerow([sent_no] + [stats.get(field, 0) for field in STATS_FIELDS])
 
-def compare_trees(gold_tree, test_tree, out_dict, error_counts, classify):
+    totals = {
+        'sentences searched': len(rows),
+        'sentences from cache': cached,
+        'sentences repeated': repeated
+    }
+    for field in STATS_FIELDS:
+        totals[field] = sum([stats.get(field, 0) for sent_no, stats in rows])
+    sentences = []
+    for sent_no, stats in rows:
+        sentence = {'sentence': sent_no}
+        for field in STATS_FIELDS:
+            sentence[field] = stats.get(field, 0)
+        sentences.append(sentence)
+    with open(prefix + '.stats.json', 'w') as out:
+        json.dump({'run': totals, 'sentences': sentences}, out, indent=1)
+
+
+def compare_trees(gold_tree, test_tree, out_dict, error_counts, classify, search=greedy_search):
     """ Compares two trees. """
     init_errors = parse_errors.get_errors(test_tree, gold_tree)
     error_count = len(init_errors)
     print("{} Initial errors".format(error_count), file=out_dict['out'])
-    iters, path = greedy_search(gold_tree, test_tree, classify)
+    if stats_enabled:
+        classify = timed('classify', classify)
+    start = time.time()
+    iters, path = search(gold_tree, test_tree, classify)
+    count_stat('time search', time.time() - start)
+    count_stat('iterations', iters[1])
+    count_stat('repeated', iters[2])
     print("{} on fringe, {} iterations".format(*iters), file=out_dict['out'])
-    if path is not None:
-        print(test_tree, file=out_dict['test_trees'])
-        print(gold_tree, file=out_dict['gold_trees'])
-        for tree in path[1:]:
-            print("{} Error:{}".format(str(tree[2]),tree[1]['classified_type']), file=out_dict['out'])
-
-        if len(path) > 1:
-            for tree in path:
-                print("Step:{}".format(tree[1]['classified_type']), file=out_dict['out'])
-                error_counts[tree[1]['classified_type']].append(tree[2])
-                print(tree[1], file=out_dict['out'])
-                print(render_tree.text_coloured_errors(tree[0], gold=gold_tree).strip(), file=out_dict['out'])
-    else:
-        print("no path found", file=out_dict['out'])
+    print("{} of {} successors repeated a tree state".format(*iters[2:]), file=out_dict['err'])
+    if path[-1][1]['type'] == 'unexplained':
+        print("Search stopped by the {} limit".format(path[-1][1]['limit']), file=out_dict['err'])
+    print(test_tree, file=out_dict['test_trees'])
+    print(gold_tree, file=out_dict['gold_trees'])
+    for tree in path[1:]:
+        print("{} Error:{}".format(str(tree[2]),tree[1]['classified_type']), file=out_dict['out'])
+
+    if len(path) > 1:
+        for tree in path:
+            print("Step:{}".format(tree[1]['classified_type']), file=out_dict['out'])
+            error_counts[tree[1]['classified_type']].append(tree[2])
+            print(tree[1], file=out_dict['out'])
+            print(render_tree.text_coloured_errors(tree[0], gold=gold_tree).strip(), file=out_dict['out'])
     print("", file=out_dict['err'])
     print("", file=out_dict['out'])
 
 
-def read_tree(text, out_dict, label):
+def prepare_tree(text):
+    '''Read a tree and normalise it, returning the tree as read and the
+    normalised tree, which is None if nothing is left.  Both are None if no tree
+    could be read.'''
     fake_file = io.StringIO(text)
-    complete_tree = treebanks.ptb_read_tree(fake_file)
+    return prepare_read_tree(treebanks.ptb_read_tree(fake_file))
+
+
+def prepare_read_tree(complete_tree):
+    '''Normalise a tree as prepare_tree does, for a tree that has already been
+    read (such as one from a tree store, where empty trees are None).'''
     if complete_tree is None:
-        return None
+        return None, None
     treebanks.homogenise_tree(complete_tree)
     if not complete_tree.label.strip():
         complete_tree.label = 'ROOT'
     tree = treebanks.apply_collins_rules(complete_tree)
+    return complete_tree, tree
+
+
+def freeze_prepared(prepared):
+    '''Store the trees from prepare_tree as FlatTrees, to keep them in memory
+    compactly.'''
+    return tuple(None if tree is None else flat_tree.FlatTree.from_pstree(tree) for tree in prepared)
+
+
+def thaw_prepared(frozen):
+    '''Copy trees stored by freeze_prepared back into PSTrees.'''
+    return tuple(None if tree is None else tree.to_pstree() for tree in frozen)
+
+
+def read_tree(text, out_dict, label, prepared=None):
+    if prepared is None:
+        prepared = prepare_tree(text)
+    complete_tree, tree = prepared
+    if complete_tree is None:
+        return None
     if tree is None:
         for out in [out_dict['out'], out_dict['err']]:
             print("Empty {} tree".format(label), file=out)
@@ -338,10 +897,11 @@ def read_tree(text, out_dict, label):
     return tree
 
 
-def compare(gold_text, test_text, out_dict, error_counts, classify):
+def compare(gold_text, test_text, out_dict, error_counts, classify, search=greedy_search, gold=None):
     """ Compares two trees in text form.
     This checks for empty trees and mismatched numbers
-    of words.
+    of words.  gold can be the result of prepare_tree on gold_text, to avoid
+    preparing it again.
     """
     gold_text = gold_text.strip()
     test_text = test_text.strip()
@@ -353,7 +913,7 @@ def compare(gold_text, test_text, out_dict, error_counts, classify):
         print("Not parsed", file=out_dict['out'])
         print("Not parsed", file=out_dict['err'])
         return
-    gold_tree = read_tree(gold_text, out_dict, 'gold')
+    gold_tree = read_tree(gold_text, out_dict, 'gold', gold)
     test_tree = read_tree(test_text, out_dict, 'test')
     if gold_tree is None or test_tree is None:
         print("Not parsed, but had output", file=out_dict['out'])
@@ -371,65 +931,741 @@ def compare(gold_text, test_text, out_dict, error_counts, classify):
             print("Test: " + test_words, file=out)
         return
 
-    compare_trees(gold_tree, test_tree, out_dict, error_counts, classify)
+    compare_trees(gold_tree, test_tree, out_dict, error_counts, classify, search)
 
 
-def main(args, classify):
-    init.argcheck(args, 4, 4, 'Identify errors in parser output', '<gold> <test> <prefix_for_output_files>')
+SENTENCE_OUTPUTS = ['out', 'err', 'gold_trees', 'test_trees', 'init_errors']
 
-    # Output setup
-    out_dict = {
-        'out': sys.stdout,
-        'err': sys.stderr,
-        'gold_trees': sys.stdout,
-        'test_trees': sys.stdout,
-        'error_counts': sys.stdout
-    }
-    prefix = args[3]
-    out_dict['out'] = open(prefix + '.out', 'w')
-    out_dict['err'] = open(prefix + '.log', 'w')
-    out_dict['gold_trees'] = open(prefix + '.gold_trees', 'w')
-    out_dict['test_trees'] = open(prefix + '.test_trees', 'w')
-    out_dict['error_counts'] = open(prefix + '.error_counts', 'w')
-    out_dict['init_errors'] = open(prefix + '.init_errors', 'w')
-    init.header(args, [v for v in out_dict.values()])
+def compare_sentence(gold_text, test_text, classify, search=greedy_search, gold=None):
+    '''Compare one pair of trees, returning the text for each output file and
+    the error counts, so that sentences can be processed independently.'''
+    out_dict = {}
+    for key in SENTENCE_OUTPUTS:
+        out_dict[key] = io.StringIO()
+    error_counts = defaultdict(lambda: [])
 
-    # Classification
-    print("Printing tree transformations", file=out_dict['out'])
-    print("Printing tree transformations", file=out_dict['err'])
-    gold_in = open(args[1])
-    test_in = sys.stdin if args[2] == '-' else open(args[2])
+    compare(gold_text.strip(), test_text.strip(), out_dict, error_counts, classify, search, gold)
+
+    texts = {}
+    for key in SENTENCE_OUTPUTS:
+        texts[key] = out_dict[key].getvalue()
+    return texts, dict(error_counts)
+
+
+def sentence_parts(sent_no):
+    '''The text that goes before and after the output from compare_sentence
+    in each file: a heading with the sentence number, and a gap between
+    sentences in init_errors.'''
+    heading = "Sentence {}:\n".format(sent_no)
+    parts = dict((key, ('', '')) for key in SENTENCE_OUTPUTS)
+    for key in ['out', 'err']:
+        parts[key] = (heading, '')
+    parts['init_errors'] = (heading, "\n\n")
+    return parts
+
+
+def number_sentence(sent_no, result):
+    '''Add the sentence heading to the output from compare_sentence.'''
+    parts = sentence_parts(sent_no)
+    texts = {}
+    for key in SENTENCE_OUTPUTS:
+        texts[key] = parts[key][0] + result[0][key] + parts[key][1]
+    return texts, result[1]
+
+
+def write_sentence(out_dict, sent_no, result):
+    '''Write the output from compare_sentence for a sentence, returning where
+    the text for each file went (its position, from tell, and length), so that
+    it can be read back with read_sentence rather than kept in memory.'''
+    parts = sentence_parts(sent_no)
+    places = {}
+    for key in SENTENCE_OUTPUTS:
+        out = out_dict[key]
+        out.write(parts[key][0])
+        places[key] = (out.tell(), len(result[0][key]))
+        out.write(result[0][key] + parts[key][1])
+    return places
+
+
+def read_sentence(out_dict, places, error_counts):
+    '''Read back output written by write_sentence, giving it in the form
+    compare_sentence does, with the error counts (which are not in the files).
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> out_dict = dict((key, open(os.path.join(directory, key), 'w')) for key in SENTENCE_OUTPUTS)
+    >>> result = (dict((key, key + " for the sentence\\n") for key in SENTENCE_OUTPUTS), {'Attachment': [2]})
+    >>> places = write_sentence(out_dict, 3, result)
+    >>> read_sentence(out_dict, places, result[1]) == result
+    True
+    >>> open(os.path.join(directory, 'init_errors')).read() == number_sentence(3, result)[0]['init_errors']
+    True
+    '''
+    texts = {}
+    for key in SENTENCE_OUTPUTS:
+        out = out_dict[key]
+        out.flush()
+        position, length = places[key]
+        with open(out.name, encoding=out.encoding) as src:
+            src.seek(position)
+            texts[key] = src.read(length)
+    return texts, error_counts
+
+
+def search_context(classify, search):
+    '''Describe everything apart from the trees that determines the result of
+    a comparison: the code, the classifier, and the search and its settings.'''
+    classifier = inspect.getsourcefile(classify)
+    filenames = [classifier, __file__]
+    util_dir = os.path.dirname(parse_errors.__file__)
+    for filename in os.listdir(util_dir):
+        if filename.endswith('.py'):
+            filenames.append(os.path.join(util_dir, filename))
+    settings = sorted(getattr(search, 'keywords', {}).items())
+    search_name = getattr(search, 'func', search).__name__
+    return ' '.join([result_cache.source_version(filenames), os.path.basename(classifier),
+        classify.__name__, search_name, repr(settings)])
+
+
+def key_sentences(sentences, context):
+    '''Add a key to each pair of gold and test trees, from the context and the
+    trees with whitespace normalised.  The text of test trees in pairs seen
+    before is replaced with None, so each distinct pair is only compared once.'''
+    seen = set()
+    for sent_no, gold_text, test_texts in sentences:
+        tests = []
+        for test_text in test_texts:
+            key = result_cache.make_key(context, ' '.join(gold_text.split()), ' '.join(test_text.split()))
+            if key in seen:
+                tests.append((key, None))
+            else:
+                seen.add(key)
+                tests.append((key, test_text))
+        yield sent_no, gold_text, tests
+
+
+def classify_keyed_sentence(sentence, classify, search, cache, gold=None):
+    '''Compare each test tree in a sentence from key_sentences with the gold
+    tree, using the cache if there is one, and preparing the gold tree at most
+    once (or not at all if it is given, from prepare_tree).  Returns the
+    sentence number and a list with (key, result, whether
+    the result was cached, stats) for each test tree, with the result None for
+    repeated pairs, and stats None unless stats are enabled and the pair was
+    searched.
+
+    >>> def label_with_type(info, gold, test):
+    ...     info['classified_type'] = info['type']
+    >>> gold_text = "(ROOT (S (NP (DT The) (NN cat)) (VP (VBD sat))))"
+    >>> test_text = "(ROOT (S (NP (DT The)) (NN cat) (VP (VBD sat))))"
+    >>> sentence = (1, gold_text, [('key', test_text)])
+    >>> sent_no, results = classify_keyed_sentence(sentence, label_with_type, greedy_search, None)
+    >>> results[0][1][1]
+    {'init': [0], 'move': [2]}
+
+    A prepared gold tree is used in place of gold_text, so with the test tree
+    as the gold there are no errors:
+
+    >>> sent_no, results = classify_keyed_sentence(sentence, label_with_type, greedy_search, None, prepare_tree(test_text))
+    >>> results[0][1][1]
+    {}
+    '''
+    global sentence_stats
+    sent_no, gold_text, tests = sentence
+    results = []
+    for key, test_text in tests:
+        if test_text is None:
+            results.append((key, None, False, None))
+            continue
+        if cache is not None:
+            result = cache.get(key)
+            if result is not None:
+                results.append((key, result, True, None))
+                continue
+
+        stats = None
+        if stats_enabled:
+            sentence_stats = defaultdict(int)
+        start = time.time()
+        if gold is None:
+            gold = prepare_tree(gold_text.strip())
+        result = compare_sentence(gold_text, test_text, classify, search, gold)
+        if stats_enabled:
+            count_stat('time total', time.time() - start)
+            stats = dict(sentence_stats)
+            sentence_stats = None
+
+        if cache is not None:
+            cache.put(key, result)
+        results.append((key, result, False, stats))
+    return sent_no, results
+
+
+def input_ended(gold_text, test_texts, notes):
+    '''Check whether the lines read from the gold and test inputs show that
+    one has ended, adding a note to explain why.'''
+    if gold_text == '' and test_texts.count('') == len(test_texts):
+        notes.append("End of both input files")
+    elif gold_text == '':
+        notes.append("End of gold input")
+    elif '' in test_texts:
+        notes.append("End of test input")
+    else:
+        return False
+    return True
+
+
+def read_sentences(gold_in, test_ins, notes):
+    '''Generate numbered lines from the gold input, with a list of the
+    corresponding lines from each test input, adding a note to explain why the
+    input ended.'''
     sent_no = 0
-    error_counts = defaultdict(lambda: [])
     while True:
         sent_no += 1
         gold_text = gold_in.readline()
-        test_text = test_in.readline()
-        if gold_text == '' and test_text == '':
-            print("End of both input files", file=out_dict['err'])
-            break
-        elif gold_text == '':
-            print("End of gold input", file=out_dict['err'])
-            break
-        elif test_text == '':
-            print("End of test input", file=out_dict['err'])
-            break
+        test_texts = [test_in.readline() for test_in in test_ins]
+        if input_ended(gold_text, test_texts, notes):
+            return
+        yield sent_no, gold_text, test_texts
 
-        print("Sentence {}:".format(sent_no), file=out_dict['out'])
-        print("Sentence {}:".format(sent_no), file=out_dict['err'])
-        print("Sentence {}:".format(sent_no), file=out_dict['init_errors'])
-        compare(gold_text.strip(), test_text.strip(), out_dict, error_counts, classify)
-        print("\n", file=out_dict['init_errors'])
 
-    # Results
-    counts_to_print = []
+def read_selected_sentences(gold_name, test_names, ranges, notes):
+    '''As for read_sentences, but only for the sentences in a list of ranges
+    from init.get_sentences, which are read using an index of each file.'''
+    for sent_no, texts in tree_index.selected_lines([gold_name] + test_names, ranges):
+        if input_ended(texts[0], texts[1:], notes):
+            return
+        yield sent_no, texts[0], texts[1:]
+
+
+def stored_gold(gold_store, sent_no):
+    '''Prepare the gold tree for a sentence from a tree store, without reading
+    its text, or give None (so it is prepared from its text) without a store.'''
+    if gold_store is None:
+        return None
+    return prepare_read_tree(gold_store.tree(sent_no))
+
+
+worker_args = None
+
+def init_worker(classify, search, cache, stats, golds=None, gold_store_name=None):
+    global worker_args
+    gold_store = None
+    if gold_store_name is not None:
+        # Each worker maps the file itself, so they share its pages
+        gold_store = tree_store.TreeStore(gold_store_name)
+    worker_args = (classify, search, cache, golds, gold_store)
+    if stats:
+        enable_stats()
+
+def classify_sentence_in_worker(sentence):
+    classify, search, cache, golds, gold_store = worker_args
+    if golds is not None:
+        gold = thaw_prepared(golds[sentence[0] - 1])
+    else:
+        gold = stored_gold(gold_store, sentence[0])
+    return classify_keyed_sentence(sentence, classify, search, cache, gold)
+
+
+def output_prefixes(prefix, test_names):
+    '''The prefix for the output files for each test file.  With more than one
+    test file, the name of each is added to the prefix.
+
+    >>> output_prefixes('out', ['a/berkeley.mrg'])
+    ['out']
+    >>> output_prefixes('out', ['a/berkeley.mrg', 'a/collins.1.mrg', 'b/berkeley.mrg'])
+    ['out.berkeley', 'out.collins.1', 'out.berkeley.3']
+    '''
+    if len(test_names) == 1:
+        return [prefix]
+    ans = []
+    for test_name in test_names:
+        name = os.path.splitext(os.path.basename(test_name))[0]
+        if test_name == '-':
+            name = 'stdin'
+        if prefix + '.' + name in ans:
+            name += '.' + str(len(ans) + 1)
+        ans.append(prefix + '.' + name)
+    return ans
+
+
+def count_errors(error_counts):
+    '''Summarise error counts as (occurrences, brackets, error type) tuples,
+    most frequent first.'''
+    counts = []
     for error in error_counts:
         if error == 'UNSET init':
             continue
-        counts_to_print.append((len(error_counts[error]), sum(error_counts[error]), error))
-    counts_to_print.sort(reverse=True)
-    for error in counts_to_print:
-        print("{} {} {}".format(*error), file=out_dict['error_counts'])
+        counts.append((len(error_counts[error]), sum(error_counts[error]), error))
+    counts.sort(reverse=True)
+    return counts
+
+
+def write_matrices(prefix, names, all_counts):
+    '''Write a table with a row for each parser and a column for each type of
+    error to <prefix>.error_matrix (with the number of errors) and
+    <prefix>.bracket_matrix (with the number of brackets they account for).'''
+    totals = defaultdict(lambda: [0, 0])
+    for counts in all_counts:
+        for count, brackets, error in counts:
+            totals[error][0] += count
+            totals[error][1] += brackets
+    errors = sorted(totals, key=lambda error: (totals[error], error), reverse=True)
+    for filename, field in [(prefix + '.error_matrix', 0), (prefix + '.bracket_matrix', 1)]:
+        with open(filename, 'w') as out:
+            print('\t'.join(['parser'] + errors), file=out)
+            for name, counts in zip(names, all_counts):
+                row = {}
+                for count in counts:
+                    row[count[2]] = count[field]
+                print('\t'.join([name] + [str(row.get(error, 0)) for error in errors]), file=out)
+
+
+class AnalysisHandler(socketserver.StreamRequestHandler):
+    '''Answer requests sent to the server, one JSON object per line.  Each
+    request is either {"tests": [tree, ...]}, with test trees for the gold
+    sentences in order from the first, or {"sentences": [[number, tree], ...]},
+    with sentence numbers counting from one.  Any "id" in the request is copied
+    into the replies.  The reply is a line for each sentence with its number,
+    the text for each output file and its error counts, followed by a line with
+    "done" and the error counts for the request (occurrences, brackets, type),
+    or a line with "error" if the request is invalid.'''
+    def handle(self):
+        for line in self.rfile:
+            line = line.decode('utf-8').strip()
+            if len(line) == 0:
+                continue
+            request_id = None
+            success, response = parse_request(line, len(self.server.golds))
+            if success:
+                request_id, sentences = response
+                self.answer(request_id, sentences)
+            else:
+                self.reply(request_id, {'error': response})
+
+    def reply(self, request_id, message):
+        if request_id is not None:
+            message['id'] = request_id
+        self.wfile.write((json.dumps(message) + '\n').encode('utf-8'))
+        self.wfile.flush()
+
+    def answer(self, request_id, sentences):
+        server = self.server
+        keyed = []
+        for sent_no, test_text in sentences:
+            gold_text = server.gold_texts[sent_no - 1]
+            key = result_cache.make_key(server.context, ' '.join(gold_text.split()), ' '.join(test_text.split()))
+            keyed.append((sent_no, gold_text, [(key, test_text)]))
+        if server.pool is not None:
+            results = server.pool.imap(classify_sentence_in_worker, keyed)
+        else:
+            results = (classify_keyed_sentence(sentence, server.classify, server.search,
+                server.cache, thaw_prepared(server.golds[sentence[0] - 1])) for sentence in keyed)
+        error_counts = defaultdict(lambda: [])
+        for sent_no, sentence_results in results:
+            key, result, was_cached, stats = sentence_results[0]
+            texts, sentence_counts = number_sentence(sent_no, result)
+            for error in sentence_counts:
+                error_counts[error] += sentence_counts[error]
+            self.reply(request_id, {'sentence': sent_no, 'texts': texts, 'error_counts': sentence_counts})
+        self.reply(request_id, {'done': True, 'error_counts': count_errors(error_counts)})
+
+
+def parse_request(line, gold_count):
+    '''Read a request for the server, returning its id and a list of (sentence
+    number, test tree) pairs.
+
+    >>> parse_request('{"id": 7, "tests": ["(S (NN a))"]}', 3)
+    (True, (7, [(1, '(S (NN a))')]))
+    >>> parse_request('{"sentences": [[3, "(S (NN a))"]]}', 2)
+    (False, 'Sentence 3 is not in the gold file, which has 2')
+    >>> parse_request('{"sentences": [[true, "(S (NN a))"]]}', 2)
+    (False, 'Sentences must be pairs of a number and a tree')
+    '''
+    try:
+        request = json.loads(line)
+    except ValueError:
+        return (False, "Request is not valid JSON")
+    if not isinstance(request, dict):
+        return (False, "Request must be a JSON object")
+    if 'tests' in request:
+        sentences = list(enumerate(request['tests'], 1))
+    elif 'sentences' in request:
+        sentences = request['sentences']
+    else:
+        return (False, "Request must have tests or sentences")
+    pairs = []
+    for sentence in sentences:
+        message = "Sentences must be pairs of a number and a tree"
+        if not isinstance(sentence, (list, tuple)) or len(sentence) != 2:
+            return (False, message)
+        sent_no, test_text = sentence
+        # JSON true and false are read as bools, which are also ints
+        if isinstance(sent_no, bool) or not isinstance(sent_no, int) or not isinstance(test_text, str):
+            return (False, message)
+        if not 1 <= sent_no <= gold_count:
+            return (False, "Sentence {} is not in the gold file, which has {}".format(sent_no, gold_count))
+        pairs.append((sent_no, test_text))
+    return (True, (request.get('id'), pairs))
+
+
+def serve(address, gold_filename, classify, search, cache=None, workers=1):
+    '''Read and prepare the gold trees once, then classify the errors in test
+    trees sent to a Unix socket at address, or a TCP socket if address is
+    host:port, until interrupted.  The gold file may be a tree store, whose
+    trees are prepared without reading their text.'''
+    if tree_store.is_tree_store(gold_filename):
+        store = tree_store.TreeStore(gold_filename)
+        numbers = range(1, len(store) + 1)
+        gold_texts = [store.text(number) for number in numbers]
+        golds = [freeze_prepared(prepare_read_tree(store.tree(number))) for number in numbers]
+        store.close()
+    else:
+        gold_texts = open(gold_filename).readlines()
+        golds = [freeze_prepared(prepare_tree(text.strip())) for text in gold_texts]
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        server = socketserver.ThreadingTCPServer((host, int(port)), AnalysisHandler)
+    else:
+        if os.path.exists(address):
+            os.remove(address)
+        server = socketserver.ThreadingUnixStreamServer(address, AnalysisHandler)
+    server.daemon_threads = True
+    server.gold_texts = gold_texts
+    server.golds = golds
+    server.classify = classify
+    server.search = search
+    server.cache = cache
+    server.context = search_context(classify, search)
+    server.pool = None
+    if workers > 1:
+        # Workers are given the prepared gold trees once, as they start
+        server.pool = multiprocessing.Pool(workers, init_worker, (classify, search, cache, False, golds))
+    print("Serving {} gold trees on {}".format(len(golds), address), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if server.pool is not None:
+            server.pool.terminate()
+        if ':' not in address:
+            os.remove(address)
+
+
+# The output files for a run, and the extension of each
+OUTPUT_FILES = [('out', '.out'), ('err', '.log'), ('gold_trees', '.gold_trees'),
+    ('test_trees', '.test_trees'), ('error_counts', '.error_counts'), ('init_errors', '.init_errors')]
+
+# Seconds between checkpoints in a resumed run, when --checkpoint is not given
+RESUME_CHECKPOINT = 60.0
+
+def checkpoint_settings(args, options):
+    '''The arguments and options that must match for a run to be resumed from a
+    checkpoint, in the form they take in JSON.'''
+    ignored = ['workers', 'checkpoint', 'resume']
+    settings = [args[1:], sorted((name, options[name]) for name in options if name not in ignored)]
+    return json.loads(json.dumps(settings))
+
+
+def sentences_in_shard(sentences, first, last):
+    '''Keep the sentences numbered from first to last, and stop reading after
+    last.'''
+    for sentence in sentences:
+        if sentence[0] > last:
+            return
+        if sentence[0] >= first:
+            yield sentence
+
+
+def write_results(prefix, prefixes, out_dicts, notes, error_counts, cached, repeated, stats_rows, options):
+    '''Write what comes after the sentences: the notes on how the input ended,
+    the error counts and the stats for each parser, and the tables comparing
+    parsers if there are several.'''
+    all_counts = []
+    for i, out_dict in enumerate(out_dicts):
+        for note in notes:
+            print(note, file=out_dict['err'])
+        if options['cache'] is not None:
+            print("{} sentences from the cache, {} repeated in the input".format(cached[i], repeated[i]), file=out_dict['err'])
+        if options['stats']:
+            write_stats(prefixes[i], stats_rows[i], cached[i], repeated[i])
+
+        counts_to_print = count_errors(error_counts[i])
+        for error in counts_to_print:
+            print("{} {} {}".format(*error), file=out_dict['error_counts'])
+        all_counts.append(counts_to_print)
+    if len(out_dicts) > 1:
+        names = [name[len(prefix) + 1:] for name in prefixes]
+        write_matrices(prefix, names, all_counts)
+
+
+def file_offsets(out_dicts):
+    '''The current length of each output file.'''
+    offsets = []
+    for out_dict in out_dicts:
+        offsets.append({})
+        for name, extension in OUTPUT_FILES:
+            out_dict[name].flush()
+            offsets[-1][name] = out_dict[name].tell()
+    return offsets
+
+
+def write_checkpoint(filename, settings, sent_no, out_dicts, starts, keys, firsts, error_counts, cached, repeated, stats_rows):
+    '''Save the progress of a run after sent_no sentences: the length of each
+    output file and everything that is only written at the end.  starts holds
+    the offsets of the end of the headers and of the first sentence in each
+    file.'''
+    result_cache.write_json(filename, {
+        'settings': settings,
+        'sentences': sent_no,
+        'starts': starts,
+        'offsets': file_offsets(out_dicts),
+        'keys': sorted(keys),
+        'firsts': firsts,
+        'error_counts': error_counts,
+        'cached': cached,
+        'repeated': repeated,
+        'stats_rows': stats_rows
+    })
+
+
+def read_checkpoint(filename, settings):
+    '''Load a checkpoint, checking it was saved by a run with the same
+    settings.'''
+    try:
+        with open(filename) as src:
+            checkpoint = json.load(src)
+    except (IOError, ValueError):
+        return (False, "No checkpoint to resume from in {}".format(filename))
+    if checkpoint['settings'] != settings:
+        return (False, "The checkpoint in {} is for a run with different files or options".format(filename))
+    return (True, checkpoint)
+
+
+def main(argv, classify):
+    args, options = init.get_options(argv, {
+        'workers': 1,
+        'search': 'greedy',
+        'beam': 5,
+        'max-expansions': 1000,
+        'max-fringe': 10000,
+        'max-iterations': 100,
+        'max-time': 0.0,
+        'max-successors': 0,
+        'cache': None,
+        'stats': False,
+        'serve': None,
+        'checkpoint': 0.0,
+        'resume': False,
+        'shard': None,
+        'sentences': None
+    })
+    if options['serve'] is not None:
+        init.argcheck(args, 2, 2, 'Identify errors in parser output sent to a socket', '<gold> --serve <socket path or host:port>')
+    else:
+        init.argcheck(args, 4, -1, 'Identify errors in parser output', '<gold> <test> [<test> ...] <prefix_for_output_files>',
+            'With several test files, the output for each goes to files named with\n'
+            '<prefix>.<test file name>, and a table of the errors made by each is\n'
+            'written to <prefix>.error_matrix and <prefix>.bracket_matrix.\n'
+            'The gold and test files may be tree stores written by store_trees.py.\n\n'
+            'Options:\n'
+            '  --workers N          Classify sentences in N parallel processes\n'
+            '  --search S           Search for corrections with greedy (default), regions, beam or\n'
+            '                       bestfirst (which may not find the shortest path)\n'
+            '  --beam N             Trees kept at each step of beam search (5)\n'
+            '  --max-expansions N   Trees beam and bestfirst search may expand per sentence (1000)\n'
+            '  --max-fringe N       Successors bestfirst search may keep on its fringe (10000)\n'
+            '  --max-iterations N   Changes greedy and beam search may make per sentence (100)\n'
+            '  --max-time S         Seconds to search for each sentence (no limit)\n'
+            '  --max-successors N   Successors to score for each sentence (no limit)\n'
+            '  --cache DIR          Reuse results for sentences seen in earlier runs, stored in DIR\n'
+            '  --stats              Write search counts and timings to <prefix>.stats.csv and .json\n'
+            '  --checkpoint S       Save progress to <prefix>.checkpoint every S seconds (off by default)\n'
+            '  --resume             Continue an interrupted run from <prefix>.checkpoint (and keep\n'
+            '                       saving progress, every 60 seconds unless --checkpoint is given)\n'
+            '  --shard i/N          Only compare the i-th of N equal parts of the input, to be\n'
+            '                       combined with merge_shards.py\n'
+            '  --sentences LIST     Only compare the given sentences, e.g. 5,10-20,41207 (uses an\n'
+            '                       index of each file, kept in <file>.index)\n'
+            '  --serve ADDRESS      Keep the gold trees loaded and classify trees sent to a Unix\n'
+            '                       socket at ADDRESS, or a TCP socket if it is host:port\n'
+            '                       (give only the gold file)')
+    success, search = get_search(options)
+    if not success:
+        print(search, file=sys.stderr)
+        sys.exit(1)
+    shard = None
+    if options['shard'] is not None:
+        success, shard = init.get_shard(options['shard'])
+        if not success:
+            print(shard, file=sys.stderr)
+            sys.exit(1)
+    ranges = None
+    if options['sentences'] is not None:
+        success, ranges = init.get_sentences(options['sentences'])
+        if not success:
+            print(ranges, file=sys.stderr)
+            sys.exit(1)
+        if shard is not None or '-' in args[2:-1]:
+            print("--sentences cannot be used with --shard or with test trees from stdin", file=sys.stderr)
+            sys.exit(1)
+    if options['serve'] is not None:
+        cache = None
+        if options['cache'] is not None:
+            cache = result_cache.ResultCache(options['cache'])
+        serve(options['serve'], args[1], classify, search, cache, options['workers'])
+        return
+
+    # Output setup
+    test_names = args[2:-1]
+    prefixes = output_prefixes(args[-1], test_names)
+    checkpoint_name = args[-1] + '.checkpoint'
+    settings = checkpoint_settings(args, options)
+    checkpoint = None
+    if options['resume']:
+        if options['checkpoint'] <= 0:
+            options['checkpoint'] = RESUME_CHECKPOINT
+        success, checkpoint = read_checkpoint(checkpoint_name, settings)
+        if not success:
+            print(checkpoint, file=sys.stderr)
+            sys.exit(1)
+    out_dicts = []
+    headers = []
+    for i, prefix in enumerate(prefixes):
+        out_dict = {
+            'out': sys.stdout,
+            'err': sys.stderr,
+            'gold_trees': sys.stdout,
+            'test_trees': sys.stdout,
+            'error_counts': sys.stdout
+        }
+        if checkpoint is None:
+            for name, extension in OUTPUT_FILES:
+                out_dict[name] = open(prefix + extension, 'w')
+            init.header(argv, [v for v in out_dict.values()])
+            headers.append(file_offsets([out_dict])[0])
+        else:
+            # Drop anything written after the checkpoint
+            for name, extension in OUTPUT_FILES:
+                out_dict[name] = open(prefix + extension, 'r+')
+                out_dict[name].truncate(checkpoint['offsets'][i][name])
+                out_dict[name].seek(0, os.SEEK_END)
+        out_dicts.append(out_dict)
+
+    # Classification
+    if checkpoint is None:
+        for out_dict in out_dicts:
+            print("Printing tree transformations", file=out_dict['out'])
+            print("Printing tree transformations", file=out_dict['err'])
+        starts = [headers, file_offsets(out_dicts)]
+    else:
+        starts = checkpoint['starts']
+    # Tree stores are read as if they had one tree per line, and gold trees
+    # from a store are prepared without reading their text
+    gold_in = tree_store.open_lines(args[1])
+    test_ins = [sys.stdin if name == '-' else tree_store.open_lines(name) for name in test_names]
+    gold_store_name = args[1] if tree_store.is_tree_store(args[1]) else None
+    gold_store = None
+    if gold_store_name is not None:
+        gold_store = tree_store.TreeStore(gold_store_name)
+    notes = []
+    cache = None
+    if options['cache'] is not None:
+        cache = result_cache.ResultCache(options['cache'])
+    if options['stats']:
+        enable_stats()
+    if ranges is not None:
+        sentences = read_selected_sentences(args[1], test_names, ranges, notes)
+    else:
+        sentences = read_sentences(gold_in, test_ins, notes)
+    if shard is not None:
+        first, last = init.shard_range(shard, tree_store.count_lines(args[1]))
+        sentences = sentences_in_shard(sentences, first, last)
+    done = 0
+    earlier = set()
+    if checkpoint is not None:
+        done = checkpoint['sentences']
+        earlier = set(checkpoint['keys'])
+        sentences = (sentence for sentence in sentences if sentence[0] > done)
+    sentences = key_sentences(sentences, search_context(classify, search))
+    pool = None
+    if options['workers'] > 1:
+        # Sentences are independent, results are written back in order
+        pool = multiprocessing.Pool(options['workers'], init_worker,
+            (classify, search, cache, options['stats'], None, gold_store_name))
+        results = pool.imap(classify_sentence_in_worker, sentences)
+    else:
+        results = (classify_keyed_sentence(sentence, classify, search, cache, stored_gold(gold_store, sentence[0]))
+            for sentence in sentences)
+    error_counts = [defaultdict(lambda: []) for out_dict in out_dicts]
+    seen = {}
+    cached = [0 for out_dict in out_dicts]
+    repeated = [0 for out_dict in out_dicts]
+    stats_rows = [[] for out_dict in out_dicts]
+    # For shards, the first occurrence of each pair, so that merge_shards.py
+    # can tell which were repeats of pairs in earlier shards
+    firsts = []
+    if checkpoint is not None:
+        for i in range(len(out_dicts)):
+            error_counts[i].update(checkpoint['error_counts'][i])
+        cached = checkpoint['cached']
+        repeated = checkpoint['repeated']
+        stats_rows = checkpoint['stats_rows']
+        firsts = checkpoint['firsts']
+    last_checkpoint = time.time()
+    for sent_no, sentence_results in results:
+        for i, (key, result, was_cached, stats) in enumerate(sentence_results):
+            if stats is not None:
+                stats_rows[i].append((sent_no, stats))
+            if result is None:
+                result = read_sentence(*seen[key])
+                repeated[i] += 1
+            else:
+                if key in earlier:
+                    # Compared again as the earlier result was not kept
+                    repeated[i] += 1
+                else:
+                    cached[i] += was_cached
+                    if shard is not None:
+                        firsts.append((sent_no, i, key, was_cached))
+            places = write_sentence(out_dicts[i], sent_no, result)
+            if key not in seen:
+                # Only where the output went is kept (and the error counts,
+                # which are small), so memory does not grow with the output
+                seen[key] = (out_dicts[i], places, result[1])
+            for error in result[1]:
+                error_counts[i][error] += result[1][error]
+        if 0 < options['checkpoint'] <= time.time() - last_checkpoint:
+            write_checkpoint(checkpoint_name, settings, sent_no, out_dicts, starts,
+                earlier.union(seen), firsts, error_counts, cached, repeated, stats_rows)
+            last_checkpoint = time.time()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    # Results
+    if shard is not None:
+        # Everything merge_shards.py needs to combine this run with the others
+        result_cache.write_json(args[-1] + '.shard', {
+            'kind': 'analysis',
+            'shard': shard,
+            'settings': settings,
+            'names': [prefix[len(args[-1]):] for prefix in prefixes],
+            'files': OUTPUT_FILES,
+            'headers': starts[0],
+            'starts': starts[1],
+            'ends': file_offsets(out_dicts),
+            'notes': notes,
+            'firsts': firsts,
+            'error_counts': error_counts,
+            'cached': cached,
+            'repeated': repeated,
+            'stats_rows': stats_rows
+        })
+    write_results(args[-1], prefixes, out_dicts, notes, error_counts, cached, repeated, stats_rows, options)
+    if os.path.exists(checkpoint_name):
+        os.remove(checkpoint_name)
 
 
 if __name__ == '__main__':